@@ -1,6 +1,9 @@
 import streamlit as st
 from PIL import Image, ImageDraw, ImageFont
 import io
+from functools import partial
+
+from label_engine import label_pieces, zip_sheets
 
 # Constants
 DPI = 300
@@ -18,16 +21,91 @@ A4_WIDTH_PX = int((210 / 25.4) * DPI)
 A4_HEIGHT_PX = int((297 / 25.4) * DPI)
 MAX_STICKERS_ON_PAGE = NUM_COLUMNS * NUM_ROWS
 
+# Top-left corner of every sticker on a sheet, row by row, computed once
+X_MARGIN = (A4_WIDTH_PX - (STICKER_WIDTH * NUM_COLUMNS)) // 2
+Y_MARGIN = (A4_HEIGHT_PX - (STICKER_HEIGHT * NUM_ROWS)) // 2
+GRID_POSITIONS = [
+    (X_MARGIN + col * STICKER_WIDTH, Y_MARGIN + row * STICKER_HEIGHT)
+    for row in range(NUM_ROWS)
+    for col in range(NUM_COLUMNS)
+]
+
+# Text block offsets inside a sticker; every sticker has five lines
+TEXT_LINE_COUNT = 5
+TEXT_LEFT = 10
+TOTAL_TEXT_HEIGHT = TEXT_LINE_COUNT * (FONT_SIZE + LINE_SPACING) - LINE_SPACING
+TEXT_TOP = max(10, (STICKER_HEIGHT - TOTAL_TEXT_HEIGHT) // 2)
+
 
 # Load font
 def load_font():
     try:
         return ImageFont.truetype("fonts/arialbd.ttf", FONT_SIZE)
-    except:
+    except OSError:
         return ImageFont.load_default()
 
 font = load_font()
 
+# Draw text lines starting at line number `first_line` of the text block
+def draw_lines(draw, x_pos, y_pos, lines, first_line=0, fill="black"):
+    for i, line in enumerate(lines, start=first_line):
+        y_text = y_pos + TEXT_TOP + i * (FONT_SIZE + LINE_SPACING)
+        draw.text((x_pos + TEXT_LEFT, y_text), line, font=font, fill=fill)
+
+# Ink of the border and the three lines every sticker of the job shares, drawn
+# once and stamped onto each sticker.  Lines too long for the sticker run on
+# past its right edge, as when they are drawn directly.
+def render_sticker_template(date, invoice_no, supplier):
+    lines = [
+        f"Date: {date}".upper(),
+        f"Invoice: {invoice_no}".upper(),
+        f"Supplier : {supplier}".upper(),
+    ]
+    width = max([STICKER_WIDTH + 1] + [TEXT_LEFT + font.getbbox(line)[2] for line in lines])
+    template = Image.new("L", (width, STICKER_HEIGHT + 1), 0)
+    draw = ImageDraw.Draw(template)
+    draw.rectangle([0, 0, STICKER_WIDTH, STICKER_HEIGHT], outline=255, width=2)
+    draw_lines(draw, 0, 0, lines, fill=255)
+    return template
+
+# Number of sheets needed for all pieces
+def sheet_count(item_pieces):
+    return (sum(item_pieces.values()) + MAX_STICKERS_ON_PAGE - 1) // MAX_STICKERS_ON_PAGE
+
+# Draw sheet number `sheet_number` (from 1) of the job and return it PNG-encoded
+def render_sheet(date, invoice_no, supplier, item_pieces, sheet_number, template=None):
+    if template is None:
+        template = render_sticker_template(date, invoice_no, supplier)
+    first = (sheet_number - 1) * MAX_STICKERS_ON_PAGE
+    stickers = label_pieces(item_pieces, first, MAX_STICKERS_ON_PAGE)
+
+    sticker_sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
+    draw = ImageDraw.Draw(sticker_sheet)
+    for (x_pos, y_pos), (item_num, piece_num, num_pieces) in zip(GRID_POSITIONS, stickers):
+        sticker_sheet.paste("black", (x_pos, y_pos), template)
+        lines = [
+            f"Item: {item_num}".upper(),
+            f"Piece: {piece_num}/{num_pieces}".upper()
+        ]
+        draw_lines(draw, x_pos, y_pos, lines, first_line=3)
+
+    img_buffer = io.BytesIO()
+    sticker_sheet.save(img_buffer, format='PNG')
+    return img_buffer.getvalue()
+
+# Yield (filename, png bytes) for every sheet of the job, one sheet at a time
+def iter_sheets(date, invoice_no, supplier, item_pieces):
+    template = render_sticker_template(date, invoice_no, supplier)
+    for sheet_number in range(1, sheet_count(item_pieces) + 1):
+        yield f"stickers_page_{sheet_number}.png", render_sheet(
+            date, invoice_no, supplier, item_pieces, sheet_number, template=template
+        )
+
+# All sheets as one ZIP, built only when its download button is clicked
+def sheets_zip(date, invoice_no, supplier, item_pieces):
+    with zip_sheets(iter_sheets(date, invoice_no, supplier, item_pieces)) as archive:
+        return archive.read()
+
 # Streamlit UI
 st.title("Sticker Sheet Generator")
 
@@ -48,55 +126,35 @@ with st.form("sticker_form"):
     submitted = st.form_submit_button("Generate Stickers")
 
 if submitted:
-    # Create sticker sheet image
-    sticker_sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
-    draw = ImageDraw.Draw(sticker_sheet)
-    x_margin = (A4_WIDTH_PX - (STICKER_WIDTH * NUM_COLUMNS)) // 2
-    y_margin = (A4_HEIGHT_PX - (STICKER_HEIGHT * NUM_ROWS)) // 2
-
-    sticker_index = 0
-    for item_num, num_pieces in item_pieces.items():
-        for piece_num in range(1, num_pieces + 1):
-            if sticker_index >= MAX_STICKERS_ON_PAGE:
-                break
-
-            row = sticker_index // NUM_COLUMNS
-            col = sticker_index % NUM_COLUMNS
-            x_pos = x_margin + col * STICKER_WIDTH
-            y_pos = y_margin + row * STICKER_HEIGHT
-
-            draw.rectangle(
-                [x_pos, y_pos, x_pos + STICKER_WIDTH, y_pos + STICKER_HEIGHT],
-                outline="black",
-                width=2
-            )
-
-            lines = [
-                f"Date: {date}".upper(),
-                f"Invoice: {invoice_no}".upper(),
-                f"Supplier : {supplier}".upper(),
-                f"Item: {item_num}".upper(),
-                f"Piece: {piece_num}/{num_pieces}".upper()
-            ]
-
-            total_text_height = len(lines) * (FONT_SIZE + LINE_SPACING) - LINE_SPACING
-            y_text_start = max(y_pos + 10, y_pos + (STICKER_HEIGHT - total_text_height) // 2)
-
-            for i, line in enumerate(lines):
-                draw.text((x_pos + 10, y_text_start + i * (FONT_SIZE + LINE_SPACING)), line, font=font, fill="black")
-
-            sticker_index += 1
-
-    # Save to BytesIO
-    img_buffer = io.BytesIO()
-    sticker_sheet.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
+    # Keep the job across reruns, so paging and downloads do not lose it
+    st.session_state["sticker_job"] = (date, invoice_no, supplier, dict(item_pieces))
+    st.session_state["sticker_page"] = 1
+
+if "sticker_job" in st.session_state:
+    job = st.session_state["sticker_job"]
+    total_sheets = sheet_count(job[3])
+
+    # Every sheet in one ZIP
+    st.download_button(
+        label=f"Download All {total_sheets} Sticker Sheet(s) (ZIP)",
+        data=partial(sheets_zip, *job),
+        file_name="stickers.zip",
+        mime="application/zip"
+    )
+
+    # Only the sheet on screen is rendered
+    sheet_number = 1
+    if total_sheets > 1:
+        sheet_number = st.number_input(
+            f"Sheet (1-{total_sheets})", min_value=1, max_value=total_sheets, key="sticker_page"
+        )
+    sheet_data = render_sheet(*job, sheet_number)
 
     # Display preview and download button
-    st.image(sticker_sheet, caption="Sticker Sheet Preview", use_column_width=True)
+    st.image(sheet_data, caption=f"Sticker Sheet {sheet_number} of {total_sheets} Preview", use_column_width=True)
     st.download_button(
-        label="Download Sticker Sheet",
-        data=img_buffer,
-        file_name="stickers_page_1.png",
+        label=f"Download Sticker Sheet {sheet_number}",
+        data=sheet_data,
+        file_name=f"stickers_page_{sheet_number}.png",
         mime="image/png"
     )
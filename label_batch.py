@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+from label_engine import PNG_COMPRESSION, iter_sheets, sheet_grid
+from sticker_generat import LABEL_LAYOUT, layout_invoice_labels, layout_packed_invoice_labels
+
+# Headless batch generation of invoice label sheets.
+#
+# Reads a manifest with one row per invoice item, e.g.
+#
+#     date,invoice,supplier,item,pieces
+#     01-07-2024,INV-123,ACME Textiles,1,40
+#     01-07-2024,INV-123,ACME Textiles,2,25
+#     02-07-2024,INV-124,Wilton Yarns,1,12
+#
+# from CSV or XLSX, lays every invoice out exactly like the Streamlit
+# generator, renders all sheets of all invoices through one worker pool and
+# writes them to <output dir>/<invoice>/, each with a manifest.json.
+#
+#     python label_batch.py invoices.xlsx -o labels --workers 8
+#
+# With --pack, all invoices share continuous sheets instead of each starting a
+# fresh one, written to <output dir>/ with one manifest.json saying where each
+# invoice's labels are.  --separators puts a header label before each invoice,
+# and --start-cell N skips the first N cells of a partly used first sheet.
+#
+#     python label_batch.py invoices.csv -o labels --pack --separators --start-cell 12
+
+MANIFEST_COLUMNS = ["date", "invoice", "supplier", "item", "pieces"]
+
+
+# Load a CSV / XLSX manifest as a DataFrame with the expected columns
+def read_manifest(path):
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm", ".xls"):
+        df = pd.read_excel(path, dtype=str)
+    else:
+        df = pd.read_csv(path, dtype=str)
+    df.columns = [str(column).strip().lower() for column in df.columns]
+
+    missing = [column for column in MANIFEST_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+
+    df = df[MANIFEST_COLUMNS].dropna(how="all")
+    df = df.fillna("").apply(lambda column: column.str.strip())
+    pieces = pd.to_numeric(df["pieces"], errors="coerce")
+    bad = pieces.isna() | (pieces % 1 != 0)
+    if bad.any():
+        # Index 0 is the first row under the header, i.e. row 2 of the file
+        rows = ", ".join(str(index + 2) for index in df.index[bad])
+        raise ValueError(f"{path}: 'pieces' must be a whole number (row(s) {rows})")
+    df["pieces"] = pieces.astype(int)
+    return df
+
+# Group manifest rows into jobs: (date, invoice, supplier, {item: pieces}).
+# Invoices keep the order of their first row, items the order they are listed.
+def manifest_jobs(df):
+    jobs = []
+    for (invoice, date, supplier), rows in df.groupby(["invoice", "date", "supplier"], sort=False):
+        items_data = {}
+        for item, pieces in zip(rows["item"], rows["pieces"]):
+            if pieces > 0:
+                item = int(item) if item.isdigit() else item
+                items_data[item] = items_data.get(item, 0) + pieces
+        if items_data:
+            jobs.append((date, invoice, supplier, items_data))
+    return jobs
+
+# Directory name for an invoice number
+def invoice_dirname(invoice_no):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", invoice_no).strip("._") or "invoice"
+
+# Render every job's sheets into output_dir; returns the per-invoice manifests.
+# One worker draws in this process and encodes PNGs on background threads.
+def run_batch(jobs, output_dir, workers=None, canvas_mode="L", compression="default"):
+    all_specs, manifests, used_dirs = [], [], set()
+    for date, invoice_no, supplier, items_data in jobs:
+        sheet_specs, font_size = layout_invoice_labels(
+            date, invoice_no, supplier, items_data, canvas_mode=canvas_mode
+        )
+        dirname = invoice_dirname(invoice_no)
+        if dirname in used_dirs:
+            # Same invoice number listed with another date / supplier
+            dirname = f"{dirname}_{len(manifests) + 1}"
+        used_dirs.add(dirname)
+        invoice_dir = os.path.join(output_dir, dirname)
+        os.makedirs(invoice_dir, exist_ok=True)
+        manifests.append({
+            "date": date,
+            "invoice": invoice_no,
+            "supplier": supplier,
+            "items": {str(item): pieces for item, pieces in items_data.items()},
+            "labels": sum(items_data.values()),
+            "font_size": font_size,
+            "directory": invoice_dir,
+            "sheets": [f"Invoice_Labels_Sheet_{n}.png" for n in range(1, len(sheet_specs) + 1)],
+        })
+        all_specs.extend(dict(spec, compress_level=PNG_COMPRESSION[compression]) for spec in sheet_specs)
+
+    # One pool for the whole batch; sheets arrive in order, so each is written
+    # to the invoice and file name it was laid out for
+    sheet_paths = [
+        os.path.join(manifest["directory"], filename)
+        for manifest in manifests
+        for filename in manifest["sheets"]
+    ]
+    if workers == 1:
+        sheets = iter_sheets(all_specs, pipeline=True)
+    else:
+        sheets = iter_sheets(all_specs, parallel=True, max_workers=workers)
+    for path, sheet_data in zip(sheet_paths, sheets):
+        with open(path, "wb") as f:
+            f.write(sheet_data)
+
+    for manifest in manifests:
+        with open(os.path.join(manifest["directory"], "manifest.json"), "w") as f:
+            json.dump({key: value for key, value in manifest.items() if key != "directory"}, f, indent=2)
+    return manifests
+
+# Render all jobs packed onto shared sheets in output_dir; returns the
+# manifest, with each invoice's first and last label as (sheet, cell), from 1
+def run_packed_batch(jobs, output_dir, workers=None, canvas_mode="L", compression="default", separators=False,
+                     start_cell=0):
+    sheet_specs, font_size = layout_packed_invoice_labels(
+        jobs, separators=separators, start_cell=start_cell, canvas_mode=canvas_mode
+    )
+    cells_per_sheet = len(sheet_grid(LABEL_LAYOUT)["cells"])
+
+    invoices, next_cell = [], start_cell
+    for date, invoice_no, supplier, items_data in jobs:
+        next_cell += separators
+        labels = sum(items_data.values())
+        first, last = next_cell, next_cell + labels - 1
+        invoices.append({
+            "date": date,
+            "invoice": invoice_no,
+            "supplier": supplier,
+            "items": {str(item): pieces for item, pieces in items_data.items()},
+            "labels": labels,
+            "first": [first // cells_per_sheet + 1, first % cells_per_sheet + 1],
+            "last": [last // cells_per_sheet + 1, last % cells_per_sheet + 1],
+        })
+        next_cell += labels
+    manifest = {
+        "font_size": font_size,
+        "start_cell": start_cell,
+        "separators": separators,
+        "invoices": invoices,
+        "sheets": [f"Packed_Labels_Sheet_{n}.png" for n in range(1, len(sheet_specs) + 1)],
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    sheet_specs = [dict(spec, compress_level=PNG_COMPRESSION[compression]) for spec in sheet_specs]
+    if workers == 1:
+        sheets = iter_sheets(sheet_specs, pipeline=True)
+    else:
+        sheets = iter_sheets(sheet_specs, parallel=True, max_workers=workers)
+    for filename, sheet_data in zip(manifest["sheets"], sheets):
+        with open(os.path.join(output_dir, filename), "wb") as f:
+            f.write(sheet_data)
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate invoice label sheets from a CSV / XLSX manifest.")
+    parser.add_argument("manifest", help="CSV or XLSX file with columns: " + ", ".join(MANIFEST_COLUMNS))
+    parser.add_argument("-o", "--output-dir", default="labels", help="directory to write sheets to (default: labels)")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU; 1 renders in-process)")
+    parser.add_argument("--png-compression", choices=sorted(PNG_COMPRESSION), default="default",
+                        help="fast encodes quicker, small gives smaller files (default: default)")
+    parser.add_argument("--canvas-mode", choices=["RGB", "L", "1"], default="L",
+                        help="sheet color mode (default: L, grayscale)")
+    parser.add_argument("--pack", action="store_true", help="pack all invoices onto shared sheets")
+    parser.add_argument("--separators", action="store_true", help="with --pack, head each invoice with a label")
+    parser.add_argument("--start-cell", type=int, default=0,
+                        help="with --pack, cells already used on the first sheet (default: 0)")
+    args = parser.parse_args(argv)
+    cells_per_sheet = len(sheet_grid(LABEL_LAYOUT)["cells"])
+    if not 0 <= args.start_cell < cells_per_sheet:
+        parser.error(f"--start-cell must be between 0 and {cells_per_sheet - 1}")
+
+    try:
+        jobs = manifest_jobs(read_manifest(args.manifest))
+    except ValueError as exc:
+        parser.error(str(exc))
+    start = time.perf_counter()
+    if args.pack:
+        manifest = run_packed_batch(
+            jobs, args.output_dir, workers=args.workers, canvas_mode=args.canvas_mode,
+            compression=args.png_compression, separators=args.separators, start_cell=args.start_cell
+        )
+        elapsed = time.perf_counter() - start
+        for invoice in manifest["invoices"]:
+            print(f"{invoice['invoice']}: {invoice['labels']} labels, sheet {invoice['first'][0]} "
+                  f"cell {invoice['first'][1]} to sheet {invoice['last'][0]} cell {invoice['last'][1]}")
+        total_labels = sum(invoice["labels"] for invoice in manifest["invoices"])
+        print(f"✅ {len(manifest['invoices'])} invoice(s), {total_labels} labels, {len(manifest['sheets'])} "
+              f"packed sheet(s) in {elapsed:.1f}s -> {args.output_dir}")
+        return
+
+    manifests = run_batch(
+        jobs, args.output_dir, workers=args.workers, canvas_mode=args.canvas_mode,
+        compression=args.png_compression
+    )
+    elapsed = time.perf_counter() - start
+
+    for manifest in manifests:
+        print(f"{manifest['invoice']}: {manifest['labels']} labels, {len(manifest['sheets'])} sheet(s) "
+              f"-> {manifest['directory']}")
+    total_labels = sum(manifest["labels"] for manifest in manifests)
+    total_sheets = sum(len(manifest["sheets"]) for manifest in manifests)
+    print(f"✅ {len(manifests)} invoice(s), {total_labels} labels, {total_sheets} sheet(s) in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
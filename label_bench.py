@@ -0,0 +1,195 @@
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# Benchmark of the label generators over synthetic jobs.
+#
+# Every case (generator x job size x supplier name) runs in a fresh Python
+# process, so font and render caches start cold and peak RSS belongs to that
+# case alone.  Results are printed as a table and written as JSON, and a
+# previous results file can be passed with --compare to see the change.
+#
+#     python label_bench.py -o before.json
+#     python label_bench.py -o after.json --compare before.json
+
+# Generator module -> its generate function
+GENERATORS = {
+    "sticker_generat": "generate_invoice_labels",
+    "sagar_font_str2": "generate_labels",
+}
+
+LABEL_COUNTS = [1, 65, 650, 6500]
+
+SUPPLIERS = {
+    "short": "ACME",
+    "long": "Sri Venkateshwara Handloom Weavers Co-operative Society Ltd",
+}
+
+# The forms accept up to 1000 pieces per item
+MAX_PIECES_PER_ITEM = 1000
+
+# RenderStats phases reported together as "drawing"
+DRAWING_PHASES = ["templates", "new_image", "borders", "draw_text"]
+
+
+# {item: pieces} adding up to the given number of labels
+def synthetic_items(labels):
+    items_data, item = {}, 1
+    while labels > 0:
+        items_data[item] = min(labels, MAX_PIECES_PER_ITEM)
+        labels -= items_data[item]
+        item += 1
+    return items_data
+
+# Peak resident set size of this process and its finished children, in MiB
+def peak_rss_mb():
+    peak_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == "darwin":
+        peak_kb /= 1024
+    return round(peak_kb / 1024, 1)
+
+# Run one case in this process and return its result dict
+def run_case(generator, labels, supplier, parallel=False, pipeline=False):
+    # Importing a Streamlit script outside `streamlit run` only warns
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    from label_engine import RenderStats
+
+    module = importlib.import_module(generator)
+    generate = getattr(module, GENERATORS[generator])
+
+    stats = RenderStats()
+    start = time.perf_counter()
+    result = generate(
+        "01-07-2024", "INV-12345", SUPPLIERS[supplier], synthetic_items(labels), parallel=parallel, stats=stats,
+        pipeline=pipeline
+    )
+    elapsed = time.perf_counter() - start
+
+    # Worker processes report their sheet timings too, so in a parallel run the
+    # drawing / encoding times add up across workers and exceed the wall time
+    phases = {name: seconds for name, (seconds, _) in stats.phases.items()}
+    return {
+        "generator": generator,
+        "labels": labels,
+        "supplier": supplier,
+        "parallel": parallel,
+        "pipeline": pipeline,
+        "font_size": result[1],
+        "sheets": len(result[0]),
+        "seconds": round(elapsed, 4),
+        "labels_per_sec": round(labels / elapsed, 1),
+        "phases": {
+            "font_fitting": round(phases.get("font_fitting", 0), 4),
+            "layout": round(phases.get("layout", 0), 4),
+            "drawing": round(sum(phases.get(name, 0) for name in DRAWING_PHASES), 4),
+            "png_encoding": round(phases.get("png_encode", 0), 4),
+        },
+        "stats": stats.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+# Run one case in a fresh interpreter
+def run_case_isolated(generator, labels, supplier, parallel=False, pipeline=False):
+    command = [sys.executable, os.path.abspath(__file__), "--case", generator, str(labels), supplier]
+    if parallel:
+        command.append("--parallel")
+    if pipeline:
+        command.append("--pipeline")
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _case_key(result):
+    return (
+        result["generator"], result["labels"], result["supplier"], result["parallel"],
+        result.get("pipeline", False),
+    )
+
+def print_results(results, baseline=None):
+    previous = {_case_key(result): result for result in (baseline or {}).get("results", [])}
+    print(f"{'generator':<16} {'labels':>6} {'supplier':<8} {'sec':>8} {'labels/s':>9} "
+          f"{'fit':>7} {'layout':>7} {'draw':>7} {'encode':>7} {'RSS MiB':>8}")
+    for result in results:
+        phases = result["phases"]
+        line = (
+            f"{result['generator']:<16} {result['labels']:>6} {result['supplier']:<8} "
+            f"{result['seconds']:>8.3f} {result['labels_per_sec']:>9.1f} "
+            + " ".join(f"{phases[phase]:>7.3f}" for phase in ["font_fitting", "layout", "drawing", "png_encoding"])
+            + f" {result['peak_rss_mb']:>8.1f}"
+        )
+        before = previous.get(_case_key(result))
+        if before:
+            speedup = before["seconds"] / result["seconds"]
+            line += f"  x{speedup:.2f} speed, {result['peak_rss_mb'] - before['peak_rss_mb']:+.1f} MiB"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the label generators over synthetic jobs.")
+    parser.add_argument("-o", "--output", default="label_bench.json", help="JSON file to write results to")
+    parser.add_argument("--generators", nargs="+", choices=sorted(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--labels", nargs="+", type=int, default=LABEL_COUNTS, help="job sizes in labels")
+    parser.add_argument("--suppliers", nargs="+", choices=sorted(SUPPLIERS), default=list(SUPPLIERS))
+    parser.add_argument("--parallel", action="store_true", help="render sheets across a process pool")
+    parser.add_argument("--pipeline", action="store_true", help="encode PNGs on threads while drawing")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--case", nargs=3, metavar=("GENERATOR", "LABELS", "SUPPLIER"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        generator, labels, supplier = args.case
+        result = run_case(generator, int(labels), supplier, parallel=args.parallel, pipeline=args.pipeline)
+        print(json.dumps(result))
+        return
+
+    results = []
+    for generator in args.generators:
+        for supplier in args.suppliers:
+            for labels in args.labels:
+                results.append(
+                    run_case_isolated(generator, labels, supplier, parallel=args.parallel, pipeline=args.pipeline)
+                )
+                print(f"  {generator} {labels} labels ({supplier} supplier): {results[-1]['seconds']:.3f}s",
+                      file=sys.stderr)
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pillow": importlib.import_module("PIL").__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from label_engine import ENGINE_VERSION, PREVIEW_DPI, iter_sheets, profile_phase, scale_sheet_spec
+from label_pdf import render_pdf
+
+# Cache of rendered label output, shared by every app and session running in
+# one Streamlit server process.
+#
+# PNG sheets are cached one by one, keyed by a hash of what is drawn on that
+# sheet: its labels' text and positions, the templates they use, the page
+# geometry and the font path / size, plus the size and mtime of the font file.
+# Resubmitting a job with one item changed therefore only renders the sheets
+# whose labels changed.  PDFs are cached per job.  Entries are evicted
+# least-recently-used once the cache holds more than RENDER_CACHE_MAX_BYTES,
+# and dropped once older than RENDER_CACHE_TTL seconds.
+#
+# Behind the in-memory cache sits a DiskCache in RENDER_CACHE_DIR, shared by
+# every server process on the host and kept across restarts, so reprinting an
+# invoice rendered last week is a file read.  Its keys also cover
+# ENGINE_VERSION, and it is bounded by RENDER_DISK_CACHE_MAX_BYTES.  Set
+# LABEL_CACHE_DIR to an empty string to keep the cache in memory only.
+
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RENDER_CACHE_TTL = 60 * 60
+
+RENDER_CACHE_DIR = os.environ.get(
+    "LABEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "label_render")
+)
+RENDER_DISK_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+
+# Size and mtime of a font file, so replacing the font invalidates old entries
+def font_version(font_path):
+    try:
+        stat = os.stat(font_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+# Hash identifying one rendering ("png", "pdf", ...) of a laid-out job
+def job_key(kind, specs):
+    digest = hashlib.sha256(f"{kind}:{ENGINE_VERSION}".encode())
+    for font_path in sorted({spec["font"][0] for spec in specs}):
+        digest.update(repr((font_path, font_version(font_path))).encode())
+    digest.update(repr(specs).encode())
+    return digest.hexdigest()
+
+# Hash identifying one rendered sheet.  Template indices are replaced by the
+# template lines, so the key does not change when other sheets of the job add
+# or reorder templates.
+def sheet_key(spec):
+    templates = spec["templates"]
+    labels = [
+        (x, y, None if template is None else templates[template], lines)
+        for x, y, template, lines in spec["labels"]
+    ]
+    return job_key("png", [dict(spec, templates=None, labels=labels)])
+
+
+class RenderCache:
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES, ttl=RENDER_CACHE_TTL, disk=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+        value = self.disk.get(key) if self.disk is not None else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        if self.disk is not None:
+            self.disk.put(key, value)
+        self._put_memory(key, value)
+
+    def _put_memory(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self):
+        with self._lock:
+            info = {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+        if self.disk is not None:
+            info["disk"] = self.disk.info()
+        return info
+
+    def _drop(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+# Content-addressed files under `directory`, one per key.  Files are written
+# to a temporary name and renamed into place, so several processes can share
+# the directory and a reader never sees a partial file.  Reads bump a file's
+# mtime, and the least recently used files are deleted once the directory
+# holds more than max_bytes.
+class DiskCache:
+    def __init__(self, directory, max_bytes=RENDER_DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Estimate of the directory's size, counted on the first write so
+        # creating the cache does not walk the directory; other processes'
+        # writes are only seen when it is recounted during eviction
+        self._bytes = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(value)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            # A full or read-only disk only costs a re-render later
+            return
+        with self._lock:
+            if self._bytes is None:
+                # The new file is already in the directory
+                self._bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._bytes += len(value)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._files():
+                self._unlink(path)
+            self._bytes = 0
+
+    def info(self):
+        files = list(self._files())
+        return {
+            "directory": self.directory,
+            "entries": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+    # (path, size, mtime) of every cached file
+    def _files(self):
+        try:
+            shards = os.scandir(self.directory)
+        except OSError:
+            return
+        with shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith(".tmp-"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    # Delete least recently used files down to 3/4 of max_bytes, so eviction
+    # does not rescan the directory on every write; call with _lock held
+    def _evict(self):
+        files = sorted(self._files(), key=lambda file: file[2])
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if total <= self.max_bytes * 3 // 4:
+                break
+            if self._unlink(path):
+                total -= size
+        self._bytes = total
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # Already evicted by another process
+            return False
+        return True
+
+
+render_cache = RenderCache(disk=DiskCache(RENDER_CACHE_DIR) if RENDER_CACHE_DIR else None)
+
+
+# Like label_engine.iter_sheets, but sheets already in the cache are reused and
+# only the others are rendered (and then cached).  Sheets are still yielded in
+# order as soon as each one is available.
+def iter_cached_sheets(specs, parallel=False, cache=render_cache, stats=None, pipeline=False, pool=None,
+                       max_workers=None):
+    with profile_phase(stats, "cache_lookup", len(specs)):
+        keys = [sheet_key(spec) for spec in specs]
+        sheets = [cache.get(key) for key in keys]
+    missing = [spec for spec, sheet_data in zip(specs, sheets) if sheet_data is None]
+    rendered = iter_sheets(
+        missing, parallel=parallel, max_workers=max_workers, stats=stats, pipeline=pipeline, pool=pool
+    )
+
+    for key, sheet_data in zip(keys, sheets):
+        if sheet_data is None:
+            sheet_data = next(rendered)
+            cache.put(key, sheet_data)
+        yield sheet_data
+
+# Low-resolution previews through the cache, like label_engine.iter_previews
+def iter_cached_previews(specs, dpi=PREVIEW_DPI, parallel=False, cache=render_cache, stats=None):
+    return iter_cached_sheets([scale_sheet_spec(spec, dpi) for spec in specs], parallel=parallel, cache=cache,
+                              stats=stats)
+
+# One full-resolution sheet through the cache, e.g. for a deferred download
+def cached_sheet(spec, cache=render_cache):
+    return next(iter_cached_sheets([spec], cache=cache))
+
+# label_pdf.render_pdf through the cache
+def cached_pdf(specs, title="Invoice Labels", cache=render_cache):
+    key = job_key("pdf:" + title, specs)
+    pdf_data = cache.get(key)
+    if pdf_data is None:
+        pdf_data = render_pdf(specs, title=title)
+        cache.put(key, pdf_data)
+    return pdf_data
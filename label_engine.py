@@ -0,0 +1,832 @@
+from PIL import Image, ImageDraw, ImageFont
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+import io
+import os
+import string
+import tempfile
+import time
+import weakref
+import zipfile
+
+# Label layout and sheet rasterization shared by the label generators.
+#
+# A generator describes its sheet declaratively (see INVOICE_LAYOUT) and
+# layout_job turns an invoice into sheet descriptions, plain data that can be
+# drawn in-process or in a worker process:
+#
+#     {
+#         "size": (width_px, height_px),
+#         "dpi": 300,
+#         "mode": "RGB",          # or "L" (grayscale) / "1" (bilevel)
+#         "font": (font_path, font_size),
+#         "label_size": (label_width_px, label_height_px),
+#         "templates": [[(dx, dy, text), ...], ...],
+#         "labels": [(x, y, template_index_or_None, [(dx, dy, text), ...]), ...],
+#         "compress_level": 6,    # optional, zlib level of the PNG (0-9)
+#         "text_renderer": "atlas",   # optional, "draw" forces ImageDraw.text
+#     }
+#
+# A template is the border plus the fixed lines of a label, rasterized once
+# as an ink mask and inked into each cell through it, so a line too long for
+# the label runs on past its border exactly as when it is drawn directly.
+# Labels without a template get their border drawn directly.  Line offsets are
+# relative to the label's top-left corner.
+
+
+# Version of the engine's output.  Bump it whenever a change alters the bytes
+# of rendered sheets or PDFs, so renders cached on disk are not reused.
+ENGINE_VERSION = 2
+
+# Maximum number of (font path, size) pairs kept parsed in memory
+FONT_CACHE_SIZE = 64
+
+
+# Read a font file from disk once per process
+@lru_cache(maxsize=None)
+def read_font_file(font_path):
+    with open(font_path, "rb") as f:
+        return f.read()
+
+# Return a parsed FreeTypeFont, reusing it across calls and jobs
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_cached_font(font_path, size):
+    try:
+        font_data = read_font_file(font_path)
+    except OSError:
+        # Not a readable file path: let Pillow search its font directories
+        return ImageFont.truetype(font_path, size)
+    return ImageFont.truetype(io.BytesIO(font_data), size)
+
+# Hit / miss counters of the font cache
+def font_cache_info():
+    info = get_cached_font.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "fonts": info.currsize,
+        "max_fonts": info.maxsize,
+        "files": read_font_file.cache_info().currsize,
+    }
+
+# Bounding boxes already measured, per font object.  Fonts are cached per
+# (path, size), so this is effectively keyed by (font, size, text).
+_text_bboxes = weakref.WeakKeyDictionary()
+
+# Strings remembered per font before its metrics are dropped and re-measured
+TEXT_METRICS_CACHE_SIZE = 4096
+
+
+# Return font.getbbox(text), measuring each string only once per font
+def text_bbox(font, text):
+    bboxes = _text_bboxes.get(font)
+    if bboxes is None:
+        bboxes = _text_bboxes.setdefault(font, {})
+    bbox = bboxes.get(text)
+    if bbox is None:
+        if len(bboxes) >= TEXT_METRICS_CACHE_SIZE:
+            bboxes.clear()
+        bbox = bboxes[text] = font.getbbox(text)
+    return bbox
+
+# (top, bottom) ink extent of single characters, per font; None for blank ones
+_char_extents = weakref.WeakKeyDictionary()
+
+# Ink height of a line, as used for label line spacing.  With basic layout a
+# line's ink runs from its highest glyph top to its lowest glyph bottom, so the
+# height comes from per-character extents measured once per font: lines that
+# differ on every label, like piece numbers, cost only dictionary lookups.
+def text_height(font, text):
+    if getattr(font, "layout_engine", None) != ImageFont.Layout.BASIC:
+        # Shaping (raqm) may move glyphs vertically; measure the whole line
+        bbox = text_bbox(font, text)
+        return bbox[3] - bbox[1]
+    extents = _char_extents.get(font)
+    if extents is None:
+        extents = _char_extents.setdefault(font, {})
+    top, bottom = None, None
+    for char in set(text):
+        if char not in extents:
+            _, char_top, _, char_bottom = font.getbbox(char)
+            extents[char] = (char_top, char_bottom) if char_bottom > char_top else None
+        extent = extents[char]
+        if extent is not None:
+            top = extent[0] if top is None else min(top, extent[0])
+            bottom = extent[1] if bottom is None else max(bottom, extent[1])
+    return 0 if top is None else bottom - top
+
+# Ink width of a line
+def text_width(font, text):
+    bbox = text_bbox(font, text)
+    return bbox[2] - bbox[0]
+
+# Largest size in [min_size, max_size] at which the sample lines fit the label.
+# Binary search over the range, so wide ranges (e.g. 6-72pt) stay cheap.
+def fit_font_size(get_font, label_width, label_height, sample_text_lines,
+                  min_size=8, max_size=28, padding=0.25):
+    available_height = label_height - 0.5 * padding
+    available_width = label_width - 2 * padding
+
+    def fits(size):
+        font = get_font(size)
+        total_text_height, max_line_width = 0, 0
+        for line in sample_text_lines:
+            total_text_height += text_height(font, line)
+            max_line_width = max(max_line_width, text_width(font, line))
+        return total_text_height <= available_height and max_line_width <= available_width
+
+    best_size = min_size
+    low, high = min_size, max_size
+    while low <= high:
+        size = (low + high) // 2
+        if fits(size):
+            best_size = size
+            low = size + 1
+        else:
+            high = size - 1
+    return best_size
+
+# Load font (workers cannot receive FreeTypeFont objects, only the path)
+def load_font(font_path, size):
+    try:
+        return get_cached_font(font_path, size)
+    except OSError:
+        return ImageFont.load_default()
+
+# Sheet layout of the invoice label generators.  Lengths are in millimetres; a
+# spacing of None spreads the columns (or rows) evenly over the printable area.
+# Label lines are format strings over {date}, {invoice_no}, {supplier} and, for
+# item lines, {item}, {piece} and {pieces}.  Fixed lines are the same on every
+# label of a job; item lines change from label to label.  Separator lines head
+# each invoice when several are packed onto shared sheets (see layout_jobs).
+INVOICE_LAYOUT = {
+    "dpi": 300,
+    "page_mm": (210, 297),
+    "label_mm": (37.02, 20.99),
+    "grid": (5, 13),              # columns, rows
+    "margin_mm": (6, 12),         # left / right, top / bottom
+    "spacing_mm": (2, 0),         # between columns, between rows
+    "padding": 6,                 # px between label border and text
+    "font_sizes": (8, 28),        # range searched by fit_font_size
+    "line_spacing": 1,            # factor applied to the evened-out line gap
+    "supplier_chars": None,       # truncate the supplier name to this length
+    "sample_lines": ["DATE: {date}", "INVOICE: {invoice_no}", "SUPPLIER: {supplier}", "ITEM: 99", "PIECE: 999/999"],
+    "fixed_lines": [" DATE: {date}", " INVOICE: {invoice_no}", " SUPPLIER: {supplier}", ""],
+    "item_lines": [" ITEM: {item} ; PIECE: {piece}/{pieces}"],
+    "separator_lines": [
+        " INVOICE: {invoice_no}", " SUPPLIER: {supplier}", " DATE: {date}", "", " LABELS: {labels}"
+    ],
+}
+
+GRID_KEYS = ("dpi", "page_mm", "label_mm", "grid", "margin_mm", "spacing_mm")
+
+# Page geometry already computed, per distinct layout
+_grids = {}
+
+
+# Pixel geometry of a layout: page size, label size and the top-left corner of
+# every cell in fill order (row by row).  Computed once per layout.
+def sheet_grid(layout):
+    key = tuple(layout[name] for name in GRID_KEYS)
+    grid = _grids.get(key)
+    if grid is not None:
+        return grid
+
+    dpi = layout["dpi"]
+
+    def px(mm):
+        return int(mm / 25.4 * dpi)
+
+    page_width, page_height = px(layout["page_mm"][0]), px(layout["page_mm"][1])
+    label_width, label_height = px(layout["label_mm"][0]), px(layout["label_mm"][1])
+    cols, rows = layout["grid"]
+    margin_x, margin_y = px(layout["margin_mm"][0]), px(layout["margin_mm"][1])
+
+    def spacing(spacing_mm, page, margin, label, count):
+        if spacing_mm is not None:
+            return px(spacing_mm)
+        if count < 2:
+            return 0
+        return (page - 2 * margin - count * label) // (count - 1)
+
+    h_spacing = spacing(layout["spacing_mm"][0], page_width, margin_x, label_width, cols)
+    v_spacing = spacing(layout["spacing_mm"][1], page_height, margin_y, label_height, rows)
+
+    grid = _grids[key] = {
+        "dpi": dpi,
+        "size": (page_width, page_height),
+        "label_size": (label_width, label_height),
+        "cells": [
+            (margin_x + col * (label_width + h_spacing), margin_y + row * (label_height + v_spacing))
+            for row in range(rows)
+            for col in range(cols)
+        ],
+    }
+    return grid
+
+# Lay an invoice out on a sheet layout; returns (sheet specs, font size).
+# The fixed lines are measured once and, with stamp_template, rasterized once
+# per distinct vertical layout, so only the item lines are drawn per label.
+# Font fitting and layout times are recorded in `stats` (a RenderStats) if given.
+def layout_job(layout, font_path, date, invoice_no, supplier, items_data, stamp_template=True,
+               canvas_mode="RGB", stats=None):
+    return layout_jobs(
+        layout, font_path, [(date, invoice_no, supplier, items_data)], stamp_template=stamp_template,
+        canvas_mode=canvas_mode, stats=stats
+    )
+
+# (item, piece, pieces of the item) for `count` labels of a job from label
+# `first` on (all of them by default), in order.  Items wholly before `first`
+# are skipped without listing their pieces, so one page of a big job is cheap.
+def label_pieces(items_data, first=0, count=None):
+    pieces_list = []
+    for item, pieces in items_data.items():
+        if first >= pieces:
+            first -= pieces
+            continue
+        last = pieces if count is None else min(pieces, first + count - len(pieces_list))
+        pieces_list.extend((item, piece, pieces) for piece in range(first + 1, last + 1))
+        first = 0
+        if count is not None and len(pieces_list) == count:
+            break
+    return pieces_list
+
+# Top offsets of lines with the given heights, spread over the label height
+def _line_offsets(line_heights, label_height, padding, spacing_factor):
+    remaining_space = label_height - 2 * padding - sum(line_heights)
+    line_count = len(line_heights)
+    line_spacing = int(remaining_space // (line_count - 1)) if line_count > 1 else 0
+    if spacing_factor != 1:
+        line_spacing *= spacing_factor
+
+    offsets, current_y = [], padding
+    for line_height in line_heights:
+        offsets.append(current_y)
+        current_y += line_height + line_spacing
+    return offsets
+
+# Lay several invoices, given as (date, invoice no, supplier, {item: pieces})
+# jobs, out one after another on shared sheets; returns (sheet specs, font
+# size).  All invoices use one font size, the largest that fits every one.
+# With separators, each invoice starts with a label of its separator_lines
+# (which may use {labels}, the invoice's label count).  start_cell skips the
+# first cells of the first sheet, e.g. ones already used on a partly printed
+# label sheet.
+def layout_jobs(layout, font_path, jobs, separators=False, start_cell=0, stamp_template=True,
+                canvas_mode="RGB", stats=None):
+    grid = sheet_grid(layout)
+    label_width, label_height = grid["label_size"]
+    cells = grid["cells"]
+    if not 0 <= start_cell < len(cells):
+        raise ValueError(f"start_cell must be between 0 and {len(cells) - 1}")
+
+    job_fields = []
+    for date, invoice_no, supplier, _ in jobs:
+        if layout["supplier_chars"] is not None:
+            supplier = supplier[:layout["supplier_chars"]]
+        job_fields.append({"date": date, "invoice_no": invoice_no, "supplier": supplier})
+
+    get_font = partial(load_font, font_path)
+    min_size, max_size = layout["font_sizes"]
+    with profile_phase(stats, "font_fitting", len(jobs)):
+        font_size = min(
+            (
+                fit_font_size(get_font, label_width, label_height,
+                              [line.format(**fields) for line in layout["sample_lines"]], min_size, max_size)
+                for fields in job_fields
+            ),
+            default=max_size,
+        )
+    font = get_font(font_size)
+    layout_start = time.perf_counter()
+
+    padding = layout["padding"]
+    spacing_factor = layout["line_spacing"]
+
+    # Lay every label out up front, one grid cell each, then rasterize the
+    # sheets.  Each sheet has its own templates, only the ones its labels use.
+    sheets, labels, next_cell = [], [], start_cell
+    templates, template_index = [], {}
+
+    def next_position():
+        nonlocal labels, next_cell, templates, template_index
+        if next_cell >= len(cells):
+            sheets.append((templates, labels))
+            labels, next_cell = [], 0
+            templates, template_index = [], {}
+        next_cell += 1
+        return cells[next_cell - 1]
+
+    for fields, (_, _, _, items_data) in zip(job_fields, jobs):
+        if separators:
+            lines = [line.format(labels=sum(items_data.values()), **fields) for line in layout["separator_lines"]]
+            offsets = _line_offsets([text_height(font, line) for line in lines], label_height, padding,
+                                    spacing_factor)
+            x, y = next_position()
+            labels.append((x, y, None, [(padding, offset, line) for line, offset in zip(lines, offsets)]))
+
+        fixed_lines = [line.format(**fields) for line in layout["fixed_lines"]]
+        fixed_heights = [text_height(font, line) for line in fixed_lines]
+        for item, pieces in items_data.items():
+            for piece in range(1, pieces + 1):
+                x, y = next_position()
+                item_lines = [
+                    line.format(item=item, piece=piece, pieces=pieces, **fields) for line in layout["item_lines"]
+                ]
+                offsets = _line_offsets(
+                    fixed_heights + [text_height(font, line) for line in item_lines], label_height, padding,
+                    spacing_factor
+                )
+
+                fixed_offsets = offsets[:len(fixed_lines)]
+                item_placed = [
+                    (padding, offset, line) for line, offset in zip(item_lines, offsets[len(fixed_lines):])
+                ]
+                fixed_placed = [(padding, offset, line) for line, offset in zip(fixed_lines, fixed_offsets)]
+                if stamp_template:
+                    key = (tuple(fixed_lines), tuple(fixed_offsets))
+                    if key not in template_index:
+                        template_index[key] = len(templates)
+                        templates.append(fixed_placed)
+                    labels.append((x, y, template_index[key], item_placed))
+                else:
+                    labels.append((x, y, None, fixed_placed + item_placed))
+    sheets.append((templates, labels))
+
+    sheet_specs = [
+        {
+            "size": grid["size"],
+            "dpi": grid["dpi"],
+            "mode": canvas_mode,
+            "font": (font_path, font_size),
+            "label_size": grid["label_size"],
+            "templates": templates,
+            "labels": labels,
+        }
+        for templates, labels in sheets
+    ]
+    if stats is not None:
+        stats.add("layout", time.perf_counter() - layout_start, sum(sum(job[3].values()) for job in jobs))
+    return sheet_specs, font_size
+
+# Rasterize the border and the fixed text lines of a label as an ink mask
+# (255 where inked), widened to lines that run past the label.  Sheets of
+# mode "1" get a "1" mask, as text drawn on them is not anti-aliased.
+def render_label_template(label_size, font, lines, mode="RGB"):
+    label_width, label_height = label_size
+    width, height = label_width, label_height
+    for dx, dy, text in lines:
+        _, _, right, bottom = text_bbox(font, text)
+        width, height = max(width, int(dx + right) + 1), max(height, int(dy + bottom) + 1)
+    template = Image.new("1" if mode == "1" else "L", (width, height), 0)
+    draw = ImageDraw.Draw(template)
+    draw.rectangle(
+        [0, 0, label_width - 1, label_height - 1],
+        outline=255, width=1
+    )
+    for dx, dy, text in lines:
+        draw.text((dx, dy), text, fill=255, font=font)
+    return template
+
+# Timing of a job, phase by phase and sheet by sheet.  Pass one as `stats` to
+# iter_sheets / iter_previews (and to generators that take it) to fill it in;
+# the optional callback is called with (sheet number, sheet timings) as each
+# sheet finishes.  Timings map phase -> (seconds, count).
+class RenderStats:
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phases = {}
+        self.sheets = []
+
+    @contextmanager
+    def phase(self, name, count=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count)
+
+    def add(self, name, seconds, count=1):
+        add_timing(self.phases, name, seconds, count)
+
+    def add_sheet(self, timings):
+        self.sheets.append(timings)
+        for name, (seconds, count) in timings.items():
+            self.add(name, seconds, count)
+        if self.callback is not None:
+            self.callback(len(self.sheets), timings)
+
+    # One row per phase, e.g. for st.dataframe
+    def summary(self):
+        return [
+            {"phase": name, "seconds": round(seconds, 4), "count": count,
+             "ms_each": round(1000 * seconds / count, 3) if count else None}
+            for name, (seconds, count) in self.phases.items()
+        ]
+
+    # One row per sheet with the seconds spent in each phase
+    def sheet_summary(self):
+        return [
+            dict({"sheet": number}, **{name: round(seconds, 4) for name, (seconds, _) in timings.items()})
+            for number, timings in enumerate(self.sheets, start=1)
+        ]
+
+# Add seconds / count to timings[name]
+def add_timing(timings, name, seconds, count=1):
+    total_seconds, total_count = timings.get(name, (0.0, 0))
+    timings[name] = (total_seconds + seconds, total_count + count)
+
+# stats.phase(name), or nothing when stats is None
+def profile_phase(stats, name, count=1):
+    return nullcontext() if stats is None else stats.phase(name, count)
+
+# Characters pre-rasterized per font and sub-pixel offset.  A line containing
+# any other character is rasterized whole with ImageDraw.text instead.
+ATLAS_CHARS = string.digits + string.ascii_letters + " :;/-.,#()&'"
+
+# Glyph atlases already built, per font object
+_glyph_atlases = weakref.WeakKeyDictionary()
+
+
+# Whether the atlas can reproduce ImageDraw.text for this font: it composes
+# lines glyph by glyph, so it needs the basic (non-shaping) layout engine
+def atlas_supported(font):
+    return isinstance(font, ImageFont.FreeTypeFont) and font.layout_engine == ImageFont.Layout.BASIC
+
+# Coverage mask of `text` drawn by ImageDraw.text with its origin at the given
+# sub-pixel offset, as (mask array, dx, dy) relative to the integer origin, or
+# None if nothing is inked
+def rasterize_text(font, text, fx=0.0, fy=0.0):
+    left, top, right, bottom = font.getbbox(text)
+    # ImageDraw splits the origin into whole pixels and a fraction, so keep it
+    # non-negative for the fraction to come out the same as on the sheet
+    pad = 2
+    origin_x, origin_y = pad + max(-left, 0), pad + max(-top, 0)
+    canvas = Image.new("L", (origin_x + max(right, 0) + pad, origin_y + max(bottom, 0) + pad), 0)
+    ImageDraw.Draw(canvas).text((origin_x + fx, origin_y + fy), text, fill=255, font=font)
+    box = canvas.getbbox()
+    if box is None:
+        return None
+    return np.asarray(canvas.crop(box)), box[0] - origin_x, box[1] - origin_y
+
+# Glyph masks of ATLAS_CHARS for one sub-pixel offset, plus the advance widths
+# and kerning pairs of the font (shared across offsets)
+def glyph_atlas(font, fx, fy):
+    atlases = _glyph_atlases.get(font)
+    if atlases is None:
+        advances = {char: font.getlength(char) for char in ATLAS_CHARS}
+        atlases = _glyph_atlases.setdefault(font, {
+            "advances": advances,
+            # Glyphs are placed on whole pixels, as ImageDraw does with hinting
+            "usable": all(advance == int(advance) for advance in advances.values()),
+            "kerning": {},
+        })
+    atlas = atlases.get((fx, fy))
+    if atlas is None:
+        atlas = atlases[(fx, fy)] = {}
+        for char in ATLAS_CHARS:
+            glyph = rasterize_text(font, char, fx, fy)
+            atlas[char] = glyph and (glyph[0].astype(np.uint16), glyph[1], glyph[2])
+    return atlas, atlases
+
+# Kerning adjustment between two characters
+def _kerning(font, atlases, pair):
+    kerning = atlases["kerning"].get(pair)
+    if kerning is None:
+        advances = atlases["advances"]
+        kerning = atlases["kerning"][pair] = int(font.getlength(pair) - advances[pair[0]] - advances[pair[1]])
+    return kerning
+
+# Coverage mask of a line whose origin is at (x, y), as (mask, left, top), or
+# None if nothing is inked.  Built from the glyph atlas when every character
+# is in it, otherwise rasterized by ImageDraw.text.
+def line_mask(font, x, y, text):
+    ix, iy = int(x), int(y)
+    fx, fy = x - ix, y - iy
+    atlas, atlases = glyph_atlas(font, fx, fy)
+    if not atlases["usable"] or not all(char in atlas for char in text):
+        mask = rasterize_text(font, text, fx, fy)
+        return mask and (mask[0], ix + mask[1], iy + mask[2])
+
+    advances = atlases["advances"]
+    placed, pen, previous = [], 0, None
+    for char in text:
+        if previous is not None:
+            pen += _kerning(font, atlases, previous + char)
+        glyph = atlas[char]
+        if glyph is not None:
+            placed.append((glyph[0], ix + pen + glyph[1], iy + glyph[2]))
+        pen += int(advances[char])
+        previous = char
+    if not placed:
+        return None
+
+    left = min(gx for _, gx, _ in placed)
+    top = min(gy for _, _, gy in placed)
+    right = max(gx + mask.shape[1] for mask, gx, _ in placed)
+    bottom = max(gy + mask.shape[0] for mask, _, gy in placed)
+    # Where glyphs overlap, their coverage combines the way FreeType text does
+    # in ImageDraw: a + b - a * b / 255, with the same rounding
+    coverage = np.zeros((bottom - top, right - left), np.uint16)
+    for mask, gx, gy in placed:
+        region = coverage[gy - top:gy - top + mask.shape[0], gx - left:gx - left + mask.shape[1]]
+        overlap = region * mask + 128
+        region += mask - (((overlap >> 8) + overlap) >> 8)
+    return coverage, left, top
+
+# Ink a coverage mask black into a grayscale sheet array, rounding the same
+# way as ImageDraw's fill through a mask
+def blend_black(sheet, coverage, left, top):
+    height, width = sheet.shape[:2]
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(left + coverage.shape[1], width), min(top + coverage.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    coverage = coverage[y0 - top:y1 - top, x0 - left:x1 - left]
+    region = sheet[y0:y1, x0:x1]
+    blended = region * (255 - coverage.astype(np.uint16)) + 128
+    region[...] = ((blended >> 8) + blended) >> 8
+
+# draw_sheet for "L" / "RGB" sheets on a NumPy array: borders are set by
+# slicing, templates inked through their masks and text lines composed from
+# the glyph atlas.
+# Black ink on white is the same in every channel, so RGB sheets are drawn in
+# grayscale and converted at the end.
+def draw_sheet_atlas(spec, font, timings=None):
+    clock = time.perf_counter
+    start = clock()
+    label_width, label_height = spec["label_size"]
+    templates = [
+        np.asarray(render_label_template(spec["label_size"], font, lines, "L")) for lines in spec["templates"]
+    ]
+    templates_done = clock()
+
+    width, height = spec["size"]
+    sheet = np.full((height, width), 255, np.uint8)
+    canvas_done = clock()
+
+    border_time, text_time, text_count = 0.0, 0.0, 0
+    for x, y, template, lines in spec["labels"]:
+        label_start = clock()
+        cell = sheet[y:y + label_height, x:x + label_width]
+        if template is None:
+            cell[0] = cell[-1] = 0
+            cell[:, 0] = cell[:, -1] = 0
+        else:
+            blend_black(sheet, templates[template], x, y)
+        border_done = clock()
+        for dx, dy, text in lines:
+            mask = line_mask(font, x + dx, y + dy, text)
+            if mask is not None:
+                blend_black(sheet, *mask)
+        border_time += border_done - label_start
+        text_time += clock() - border_done
+        text_count += len(lines)
+
+    if timings is not None:
+        add_timing(timings, "templates", templates_done - start, len(templates))
+        add_timing(timings, "new_image", canvas_done - templates_done)
+        add_timing(timings, "borders", border_time, len(spec["labels"]))
+        add_timing(timings, "draw_text", text_time, text_count)
+    image = Image.fromarray(sheet)
+    return image.convert("RGB") if spec.get("mode", "RGB") == "RGB" else image
+
+# Draw one sheet description onto a new image.  Phase timings are added to the
+# `timings` dict when one is given.  Text goes through the glyph atlas unless
+# the spec sets "text_renderer": "draw" (or the sheet / font cannot use it).
+def draw_sheet(spec, timings=None):
+    clock = time.perf_counter
+    start = clock()
+    font = load_font(*spec["font"])
+    mode = spec.get("mode", "RGB")
+    if spec.get("text_renderer", "atlas") == "atlas" and mode in ("L", "RGB") and atlas_supported(font):
+        return draw_sheet_atlas(spec, font, timings)
+    label_width, label_height = spec["label_size"]
+    templates = [render_label_template(spec["label_size"], font, lines, mode) for lines in spec["templates"]]
+    templates_done = clock()
+
+    # Labels are black ink on white, so "L" is lossless against "RGB" at a third
+    # of the memory, and "1" trades anti-aliasing for 1 bit per pixel
+    sheet = Image.new(mode, spec["size"], "white")
+    draw = ImageDraw.Draw(sheet)
+    canvas_done = clock()
+
+    border_time, text_time, text_count = 0.0, 0.0, 0
+    for x, y, template, lines in spec["labels"]:
+        label_start = clock()
+        if template is None:
+            draw.rectangle(
+                [x, y, x + label_width - 1, y + label_height - 1],
+                outline="black", width=1
+            )
+        else:
+            sheet.paste("black", (x, y), templates[template])
+        border_done = clock()
+        for dx, dy, text in lines:
+            draw.text((x + dx, y + dy), text, fill="black", font=font)
+        border_time += border_done - label_start
+        text_time += clock() - border_done
+        text_count += len(lines)
+
+    if timings is not None:
+        add_timing(timings, "templates", templates_done - start, len(templates))
+        add_timing(timings, "new_image", canvas_done - templates_done)
+        add_timing(timings, "borders", border_time, len(spec["labels"]))
+        add_timing(timings, "draw_text", text_time, text_count)
+    return sheet
+
+# zlib level of sheet PNGs, and the named levels offered to users: "fast"
+# encodes several times quicker, "small" gives the smallest files
+PNG_COMPRESS_LEVEL = 6
+PNG_COMPRESSION = {"fast": 1, "default": PNG_COMPRESS_LEVEL, "small": 9}
+
+
+# PNG-encode a drawn sheet
+def encode_sheet(sheet, dpi, compress_level=PNG_COMPRESS_LEVEL):
+    buf = io.BytesIO()
+    sheet.save(buf, format="PNG", dpi=(dpi, dpi), compress_level=compress_level)
+    return buf.getvalue()
+
+# PNG-encode a sheet drawn from `spec`, recording the time in `timings`
+def encode_spec_sheet(sheet, spec, timings=None):
+    start = time.perf_counter()
+    sheet_data = encode_sheet(sheet, spec["dpi"], spec.get("compress_level", PNG_COMPRESS_LEVEL))
+    if timings is not None:
+        add_timing(timings, "png_encode", time.perf_counter() - start)
+    return sheet_data
+
+# Draw one sheet description and return it PNG-encoded
+def render_sheet(spec, timings=None):
+    return encode_spec_sheet(draw_sheet(spec, timings), spec, timings)
+
+# render_sheet plus its phase timings, as a (png bytes, timings) pair
+def profile_sheet(spec):
+    timings = {}
+    return render_sheet(spec, timings), timings
+
+# Resolution of on-screen sheet previews, and how many sheets to show at once
+PREVIEW_DPI = 96
+PREVIEW_SHEETS_PER_PAGE = 4
+
+
+# The same sheet laid out at another resolution, e.g. PREVIEW_DPI for previews.
+# Drawing at the lower resolution is far cheaper than downscaling a 300 DPI page.
+def scale_sheet_spec(spec, dpi):
+    scale = dpi / spec["dpi"]
+
+    def px(value):
+        return int(round(value * scale))
+
+    def scale_lines(lines):
+        return [(dx * scale, dy * scale, text) for dx, dy, text in lines]
+
+    font_path, font_size = spec["font"]
+    return dict(
+        spec,
+        size=(px(spec["size"][0]), px(spec["size"][1])),
+        dpi=dpi,
+        font=(font_path, max(1, round(font_size * scale))),
+        label_size=(px(spec["label_size"][0]), px(spec["label_size"][1])),
+        templates=[scale_lines(lines) for lines in spec["templates"]],
+        labels=[(px(x), px(y), template, scale_lines(lines)) for x, y, template, lines in spec["labels"]],
+    )
+
+# Yield low-resolution PNG previews of the given sheets, in order
+def iter_previews(specs, dpi=PREVIEW_DPI, parallel=False, stats=None):
+    return iter_sheets([scale_sheet_spec(spec, dpi) for spec in specs], parallel=parallel, stats=stats)
+
+# Yield PNG-encoded sheets in sheet order as soon as each one is ready; with a
+# RenderStats as `stats`, each sheet's phase timings are recorded in it.
+#
+# parallel renders sheets across max_workers processes, or on `pool`, a
+# long-lived ProcessPoolExecutor of that many workers whose font caches stay
+# warm between calls.  pipeline instead draws in the calling process and hands
+# each drawn sheet to max_workers encoder threads (zlib releases the GIL), so
+# drawing the next sheet overlaps with compressing the previous ones.
+def iter_sheets(specs, parallel=False, max_workers=None, stats=None, pipeline=False, pool=None):
+    render = render_sheet if stats is None else profile_sheet
+
+    def finish(result):
+        if stats is None:
+            return result
+        sheet_data, timings = result
+        stats.add_sheet(timings)
+        return sheet_data
+
+    if pool is None and (len(specs) < 2 or not (parallel or pipeline)):
+        for spec in specs:
+            yield finish(render(spec))
+        return
+
+    if pool is None and not parallel:
+        yield from map(finish, _iter_pipelined(specs, max_workers or PNG_ENCODER_THREADS, stats is not None))
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    if pool is not None:
+        yield from map(finish, _iter_on_pool(pool, render, specs, 2 * workers))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from map(finish, _iter_on_pool(pool, render, specs, 2 * workers))
+
+# Run render(spec) for each spec on a process pool, yielding results in order.
+# Only `window` sheets are in flight, so finished PNGs never pile up faster
+# than the caller consumes them.
+def _iter_on_pool(pool, render, specs, window):
+    pending = deque()
+    for spec in specs:
+        pending.append(pool.submit(render, spec))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# Encoder threads of the pipelined mode
+PNG_ENCODER_THREADS = 2
+
+
+# Draw sheets here and PNG-encode them on a thread pool, yielding results (or
+# (result, timings) pairs with profile) in order.  At most `encoders` drawn
+# sheets wait for encoding, which bounds the memory held in raw images.
+def _iter_pipelined(specs, encoders, profile=False):
+    with ThreadPoolExecutor(max_workers=encoders) as pool:
+        pending = deque()
+        for spec in specs:
+            timings = {} if profile else None
+            sheet = draw_sheet(spec, timings)
+            pending.append((pool.submit(encode_spec_sheet, sheet, spec, timings), timings))
+            while len(pending) > encoders:
+                future, timings = pending.popleft()
+                yield (future.result(), timings) if profile else future.result()
+        while pending:
+            future, timings = pending.popleft()
+            yield (future.result(), timings) if profile else future.result()
+
+# Render sheet descriptions, optionally across a process pool, in sheet order
+def render_sheets(specs, parallel=False, max_workers=None, stats=None, pipeline=False, pool=None):
+    return list(
+        iter_sheets(specs, parallel=parallel, max_workers=max_workers, stats=stats, pipeline=pipeline, pool=pool)
+    )
+
+# ZIP archives above this size spill from memory to a temporary file
+ZIP_SPOOL_BYTES = 32 * 1024 * 1024
+
+
+# Write (filename, PNG bytes) pairs into a ZIP archive as they arrive and return
+# the archive file, rewound.  PNG data is already deflated, so members are
+# STORED rather than compressed again.
+def zip_sheets(named_sheets, spool_limit=ZIP_SPOOL_BYTES):
+    archive = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        for filename, data in named_sheets:
+            zip_file.writestr(filename, data)
+    archive.seek(0)
+    return archive
+
+
+# Invoice jobs for the Streamlit front-ends, which bind their own layout and
+# font, e.g. partial(stream_job, LABEL_LAYOUT, FONT_PATH).  label_cache and
+# label_pdf import this module, so they are imported where they are used.
+
+# Lay the job out and return (sheet iterator, font size, sheet count); sheets are
+# rendered lazily so each PNG is available as soon as it is encoded
+def stream_job(layout, font_path, date, invoice_no, supplier, items_data, stamp_template=True, parallel=False,
+               canvas_mode="RGB", use_cache=False, stats=None, pipeline=False):
+    sheet_specs, font_size = layout_job(
+        layout, font_path, date, invoice_no, supplier, items_data, stamp_template=stamp_template,
+        canvas_mode=canvas_mode, stats=stats
+    )
+    if use_cache:
+        from label_cache import iter_cached_sheets
+        sheets = iter_cached_sheets(sheet_specs, parallel=parallel, stats=stats, pipeline=pipeline)
+    else:
+        sheets = iter_sheets(sheet_specs, parallel=parallel, stats=stats, pipeline=pipeline)
+    return sheets, font_size, len(sheet_specs)
+
+# stream_job with every sheet rendered; returns (sheets, font size, sheet count)
+def generate_job(layout, font_path, date, invoice_no, supplier, items_data, stamp_template=True, parallel=False,
+                 canvas_mode="RGB", use_cache=False, stats=None, pipeline=False):
+    sheets, font_size, total_sheets = stream_job(
+        layout, font_path, date, invoice_no, supplier, items_data, stamp_template=stamp_template,
+        parallel=parallel, canvas_mode=canvas_mode, use_cache=use_cache, stats=stats, pipeline=pipeline
+    )
+    return list(sheets), font_size, total_sheets
+
+# All sheets of the job as one vector PDF; returns (pdf bytes, font size, sheet count)
+def generate_job_pdf(layout, font_path, date, invoice_no, supplier, items_data, use_cache=False):
+    sheet_specs, font_size = layout_job(layout, font_path, date, invoice_no, supplier, items_data)
+    title = f"Invoice {invoice_no} labels"
+    if use_cache:
+        from label_cache import cached_pdf
+        pdf_data = cached_pdf(sheet_specs, title=title)
+    else:
+        from label_pdf import render_pdf
+        pdf_data = render_pdf(sheet_specs, title=title)
+    return pdf_data, font_size, len(sheet_specs)
+
+# PDF bytes of the whole job, for deferred download buttons
+def job_pdf_data(layout, font_path, date, invoice_no, supplier, items_data):
+    return generate_job_pdf(layout, font_path, date, invoice_no, supplier, items_data, use_cache=True)[0]
@@ -0,0 +1,115 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+
+from label_cache import cached_sheet, job_key
+
+# Background rendering of label jobs for the Streamlit apps.
+#
+# A job is rendered on a thread of this server process and registered under a
+# hash of its sheet descriptions, not in any session, so Streamlit reruns (a
+# widget touched, a page reloaded) never restart or lose it: the script just
+# looks the job up again and shows how far it has got.  Submitting a job that
+# is already registered returns the existing one.  Finished jobs are dropped
+# JOB_TTL seconds after they finish.
+#
+# A job only records which sheets are done, not their PNG data: the stream
+# puts every sheet in label_cache.render_cache, and sheets are read back from
+# there when shown or zipped, or rendered again if they have been evicted.
+
+# Jobs rendered at the same time, all sharing one pool of render processes
+JOB_WORKERS = 2
+JOB_TTL = 60 * 60
+RENDER_WORKERS = os.cpu_count() or 1
+
+
+class LabelJob:
+    def __init__(self, key, specs):
+        self.key = key
+        self.specs = specs
+        self.sheet_count = len(specs)
+        self.sheet_names = []      # filenames of the rendered sheets, in order
+        self.error = None
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    # Fraction of the sheets rendered so far, e.g. for st.progress
+    def progress(self):
+        with self._lock:
+            return len(self.sheet_names) / self.sheet_count if self.sheet_count else 1.0
+
+    # Snapshot of the filenames of the sheets rendered so far
+    def completed_names(self):
+        with self._lock:
+            return list(self.sheet_names)
+
+    # PNG bytes of a sheet, by index from 0
+    def sheet_data(self, index):
+        return cached_sheet(self.specs[index])
+
+    # (filename, png bytes) of the sheets rendered so far; each sheet is read
+    # from the cache only when the iterator reaches it
+    def completed_sheets(self):
+        for index, name in enumerate(self.completed_names()):
+            yield name, self.sheet_data(index)
+
+    def run(self, named_sheets):
+        try:
+            for name, _ in named_sheets:
+                with self._lock:
+                    self.sheet_names.append(name)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.finished = time.time()
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="label-job")
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# The long-lived process pool jobs render on, started on first use.  Workers
+# are spawned, not forked: forking the multi-threaded Streamlit server can
+# leave a child holding another thread's lock.
+def render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+# Drop finished jobs older than JOB_TTL; call with _jobs_lock held
+def _prune_jobs():
+    now = time.time()
+    for key in [key for key, job in _jobs.items() if job.done and job.finished + JOB_TTL < now]:
+        del _jobs[key]
+
+# Start rendering a job in the background and return its LabelJob.
+# stream(specs) must return an iterator of (filename, png bytes) that stores
+# each sheet in render_cache, e.g. through iter_cached_sheets.  A job that
+# failed is only started again with retry.
+def submit_job(specs, stream, retry=False):
+    key = job_key("job", specs)
+    with _jobs_lock:
+        _prune_jobs()
+        job = _jobs.get(key)
+        if job is None or (retry and job.error is not None):
+            job = _jobs[key] = LabelJob(key, specs)
+            _executor.submit(job.run, stream(specs))
+    return job
+
+# A registered job by key, or None once it has expired
+def get_job(key):
+    with _jobs_lock:
+        return _jobs.get(key)
@@ -0,0 +1,105 @@
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+import io
+import os
+
+from label_engine import load_font
+
+# Vector PDF output for the label engine.
+#
+# Takes the same sheet descriptions as label_engine.render_sheet, so labels
+# land on exactly the grid used for the PNG sheets: one page per sheet, text as
+# real glyphs of a font embedded once per document, borders as rectangles, and
+# each label template stored once as a form XObject and reused on every label.
+
+# Used when the label font cannot be embedded (e.g. it is missing on this host)
+FALLBACK_FONT = "Helvetica-Bold"
+
+# Font path -> registered PDF font name
+_font_names = {}
+
+
+# Register a TrueType font with reportlab once per process
+def register_font(font_path):
+    name = _font_names.get(font_path)
+    if name is None:
+        name = "Label{}-{}".format(
+            len(_font_names), os.path.splitext(os.path.basename(font_path))[0].replace(" ", "")
+        )
+        try:
+            pdfmetrics.registerFont(TTFont(name, font_path))
+        except (OSError, TTFError):
+            name = FALLBACK_FONT
+        _font_names[font_path] = name
+    return name
+
+# Draw a label's border and fixed lines with the origin at its bottom-left corner
+def _draw_label(pdf, label_size, lines, scale, font_name, font_size, ascent):
+    label_width, label_height = label_size
+    pdf.rect(0.5 * scale, 0.5 * scale, (label_width - 1) * scale, (label_height - 1) * scale, stroke=1, fill=0)
+    _draw_lines(pdf, label_height, lines, scale, font_name, font_size, ascent)
+
+# Draw text lines given as pixel offsets from the label's top-left corner
+def _draw_lines(pdf, label_height, lines, scale, font_name, font_size, ascent):
+    pdf.setFont(font_name, font_size)
+    for dx, dy, text in lines:
+        if text:
+            pdf.drawString(dx * scale, (label_height - dy) * scale - ascent, text)
+
+# Render sheet descriptions into one multi-page PDF and return its bytes
+def render_pdf(specs, title="Invoice Labels"):
+    buf = io.BytesIO()
+    pdf = None
+    forms = {}
+
+    for spec in specs:
+        scale = 72 / spec["dpi"]
+        page_width, page_height = spec["size"][0] * scale, spec["size"][1] * scale
+        label_width, label_height = spec["label_size"]
+        font_path, font_px = spec["font"]
+        font_name = register_font(font_path)
+        font_size = font_px * scale
+        if font_name == FALLBACK_FONT:
+            ascent = pdfmetrics.getAscent(font_name, font_size)
+        else:
+            # Pillow places text by its ascender; use the same one for the baseline
+            ascent = load_font(font_path, font_px).getmetrics()[0] * scale
+
+        if pdf is None:
+            pdf = canvas.Canvas(buf, pagesize=(page_width, page_height), pageCompression=1)
+            pdf.setTitle(title)
+        pdf.setPageSize((page_width, page_height))
+        pdf.setLineWidth(scale)
+
+        for x, y, template, lines in spec["labels"]:
+            left = x * scale
+            bottom = page_height - (y + label_height) * scale
+
+            form_name = None
+            if template is not None:
+                template_lines = spec["templates"][template]
+                key = (tuple(template_lines), spec["label_size"], font_name, font_size)
+                form_name = forms.get(key)
+                if form_name is None:
+                    form_name = forms[key] = f"LabelTemplate{len(forms)}"
+                    pdf.beginForm(form_name, 0, 0, label_width * scale, label_height * scale)
+                    pdf.setLineWidth(scale)
+                    _draw_label(pdf, spec["label_size"], template_lines, scale, font_name, font_size, ascent)
+                    pdf.endForm()
+
+            pdf.saveState()
+            pdf.translate(left, bottom)
+            if form_name is None:
+                _draw_label(pdf, spec["label_size"], [], scale, font_name, font_size, ascent)
+            else:
+                pdf.doForm(form_name)
+            _draw_lines(pdf, label_height, lines, scale, font_name, font_size, ascent)
+            pdf.restoreState()
+
+        pdf.showPage()
+
+    if pdf is None:
+        return b""
+    pdf.save()
+    return buf.getvalue()
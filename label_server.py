@@ -0,0 +1,304 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import shutil
+import threading
+
+from label_cache import cached_pdf, iter_cached_sheets, render_cache
+from label_engine import font_cache_info, read_font_file, zip_sheets
+from label_thermal import THERMAL_DPI, THERMAL_LANGUAGES, iter_thermal
+from sticker_generat import FONT_PATH, layout_invoice_labels
+
+# Local HTTP service rendering invoice labels for other programs (e.g. the ERP).
+#
+#     python label_server.py --port 8765 --workers 4 --queue 16
+#
+#     curl -o labels.zip localhost:8765/labels -d '{"date": "01-07-2024",
+#          "invoice": "INV-123", "supplier": "ACME", "items": {"1": 40, "2": 25}}'
+#
+# A job is laid out exactly like generate_invoice_labels does it and returned
+# as "zip" (every sheet, the default), "png" (one sheet, "sheet": n from 1),
+# "pdf", or "zpl" / "epl" for thermal printers, streamed label by label.
+# Optional keys: "canvas_mode" ("L", "RGB" or "1") and "dpi" for ZPL / EPL.
+# GET /health reports the queue and cache state.  Jobs of more than
+# MAX_LABELS_PER_JOB labels or MAX_ITEMS_PER_JOB items are rejected.
+#
+# Sheets are drawn on one long-lived process pool, so fonts stay parsed
+# between requests.  At most `workers` jobs render at a time and `queue` more
+# wait for a slot; beyond that a request gets 503 with Retry-After at once,
+# so a burst of jobs cannot pile up unbounded work.
+
+FORMATS = ["zip", "png", "pdf"] + list(THERMAL_LANGUAGES)
+
+CONTENT_TYPES = {
+    "zip": "application/zip",
+    "png": "image/png",
+    "pdf": "application/pdf",
+    "zpl": "text/plain",
+    "epl": "text/plain",
+}
+
+# Largest JSON body accepted, in bytes
+MAX_REQUEST_BYTES = 1024 * 1024
+
+# Largest job accepted.  A job is laid out in full before its first byte is
+# sent, so a few bytes of JSON must not be able to ask for millions of labels.
+MAX_LABELS_PER_JOB = 50000
+MAX_ITEMS_PER_JOB = 1000
+
+# Seconds a rejected client is asked to wait before retrying
+RETRY_AFTER = 1
+
+
+class JobError(ValueError):
+    pass
+
+
+# Jobs allowed to render at once, plus jobs allowed to wait for them
+class JobSlots:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._admitted = threading.BoundedSemaphore(workers + queue_size)
+        self._running = threading.BoundedSemaphore(workers)
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.rejected = 0
+
+    # Take a place in the queue without blocking; False when the queue is full
+    def admit(self):
+        if not self._admitted.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.waiting += 1
+        return True
+
+    # Wait for a render slot; call only after a successful admit()
+    def start(self):
+        self._running.acquire()
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+
+    def finish(self):
+        with self._lock:
+            self.active -= 1
+        self._running.release()
+        self._admitted.release()
+
+    def info(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "active": self.active,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+            }
+
+
+# Read every font a job may use once in each worker process
+def warm_worker(font_paths):
+    for font_path in font_paths:
+        try:
+            read_font_file(font_path)
+        except OSError:
+            pass
+
+# Validate a decoded JSON job; returns (date, invoice, supplier, {item: pieces})
+def parse_job(job):
+    if not isinstance(job, dict):
+        raise JobError("job must be a JSON object")
+    fields = []
+    for name in ("date", "invoice", "supplier"):
+        value = job.get(name)
+        if not isinstance(value, str) or not value.strip():
+            raise JobError(f"'{name}' must be a non-empty string")
+        fields.append(value.strip())
+
+    items = job.get("items")
+    if not isinstance(items, dict) or not items:
+        raise JobError("'items' must be an object of item -> pieces")
+    if len(items) > MAX_ITEMS_PER_JOB:
+        raise JobError(f"a job may have at most {MAX_ITEMS_PER_JOB} items")
+    items_data = {}
+    for item, pieces in items.items():
+        if not isinstance(pieces, int) or isinstance(pieces, bool) or pieces < 1:
+            raise JobError(f"pieces of item {item!r} must be a positive integer")
+        items_data[int(item) if item.isdigit() else item] = pieces
+    if sum(items_data.values()) > MAX_LABELS_PER_JOB:
+        raise JobError(f"a job may have at most {MAX_LABELS_PER_JOB} labels")
+    return (*fields, items_data)
+
+
+class LabelRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so ZPL / EPL can be streamed with chunked transfer encoding;
+    # idle keep-alive connections are closed after `timeout` seconds
+    protocol_version = "HTTP/1.1"
+    timeout = 60
+
+    # Set by make_server
+    pool = None
+    slots = None
+    max_workers = None
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_error(404, "not found")
+            return
+        self._send_json(200, {
+            "slots": self.slots.info(),
+            "font_cache": font_cache_info(),
+            "render_cache": render_cache.info(),
+        })
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/labels":
+            self._send_error(404, "not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise JobError("invalid Content-Length")
+            if length > MAX_REQUEST_BYTES:
+                self._send_error(413, "request too large")
+                return
+            job = json.loads(self.rfile.read(length) or b"null")
+            date, invoice_no, supplier, items_data = parse_job(job)
+            output_format = job.get("format", "zip")
+            if output_format not in FORMATS:
+                raise JobError(f"'format' must be one of {', '.join(FORMATS)}")
+            canvas_mode = job.get("canvas_mode", "L")
+            if canvas_mode not in ("RGB", "L", "1"):
+                raise JobError("'canvas_mode' must be RGB, L or 1")
+        except ValueError as exc:
+            self._send_error(400, str(exc))
+            return
+
+        if not self.slots.admit():
+            self.send_response(503)
+            self.send_header("Retry-After", str(RETRY_AFTER))
+            self._end_json({"error": "label queue is full, retry later"})
+            return
+        self.slots.start()
+        try:
+            sheet_specs, _ = layout_invoice_labels(
+                date, invoice_no, supplier, items_data, canvas_mode=canvas_mode
+            )
+            if output_format in THERMAL_LANGUAGES:
+                dpi = job.get("dpi", THERMAL_DPI)
+                if not isinstance(dpi, int) or dpi < 100:
+                    self._send_error(400, "'dpi' must be a printer resolution, e.g. 203 or 300")
+                    return
+                self._send_chunked(output_format, iter_thermal(sheet_specs, language=output_format, dpi=dpi))
+            elif output_format == "pdf":
+                self._send_bytes("pdf", cached_pdf(sheet_specs, title=f"Invoice {invoice_no} labels"))
+            elif output_format == "png":
+                sheet = job.get("sheet", 1)
+                if not isinstance(sheet, int) or not 1 <= sheet <= len(sheet_specs):
+                    self._send_error(400, f"'sheet' must be between 1 and {len(sheet_specs)}")
+                    return
+                self._send_bytes("png", next(self._iter_sheets(sheet_specs[sheet - 1:sheet])))
+            else:
+                named_sheets = (
+                    (f"Invoice_Labels_Sheet_{sheet_number}.png", sheet_data)
+                    for sheet_number, sheet_data in enumerate(self._iter_sheets(sheet_specs), start=1)
+                )
+                with zip_sheets(named_sheets) as archive:
+                    self._send_file("zip", archive, "Invoice_Labels.zip")
+        finally:
+            self.slots.finish()
+
+    def _iter_sheets(self, sheet_specs):
+        return iter_cached_sheets(sheet_specs, pool=self.pool, max_workers=self.max_workers)
+
+    def _send_bytes(self, output_format, data):
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[output_format])
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, output_format, f, filename):
+        size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[output_format])
+        self.send_header("Content-Length", str(size))
+        self.send_header("Content-Disposition", f'attachment; filename="{filename}"')
+        self.end_headers()
+        shutil.copyfileobj(f, self.wfile)
+
+    # Stream an iterator of byte chunks: with chunked transfer encoding to
+    # HTTP/1.1 clients, and as a body ended by closing the connection to
+    # HTTP/1.0 ones, which do not understand chunks
+    def _send_chunked(self, output_format, chunks):
+        chunked = self.request_version == "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[output_format])
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    # Error responses close the connection, as the request body may not have
+    # been read
+    def _send_error(self, status, message):
+        self.send_response(status)
+        self.send_header("Connection", "close")
+        self._end_json({"error": message})
+
+    def _send_json(self, status, body):
+        self.send_response(status)
+        self._end_json(body)
+
+    def _end_json(self, body):
+        data = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+# HTTP server rendering on `pool` with the given slots
+def make_server(host, port, pool, slots, max_workers):
+    handler = type("Handler", (LabelRequestHandler,), {"pool": pool, "slots": slots, "max_workers": max_workers})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve invoice label rendering over local HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="render worker processes and concurrent jobs (default: one per CPU)")
+    parser.add_argument("-q", "--queue", type=int, default=16,
+                        help="jobs allowed to wait for a worker before requests get 503 (default: 16)")
+    args = parser.parse_args(argv)
+
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=warm_worker, initargs=([FONT_PATH],))
+    warm_worker([FONT_PATH])
+    server = make_server(args.host, args.port, pool, JobSlots(args.workers, args.queue), args.workers)
+    print(f"Serving labels on http://{args.host}:{args.port}/labels "
+          f"({args.workers} worker(s), queue of {args.queue})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
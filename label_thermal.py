@@ -0,0 +1,148 @@
+# Thermal label printer output for the label engine.
+#
+# Takes the same sheet descriptions as label_engine.render_sheet but ignores
+# the sheet grid: every label becomes one printer label, in ZPL (Zebra) or
+# EPL (Eltron / older Zebra desktop printers), with the same lines at the same
+# offsets scaled to the printer's resolution.  Labels are generated one at a
+# time, so a job of any size can be streamed straight to a printer.
+#
+# In ZPL each label template is stored once in the printer's memory as a
+# format (^DF) and recalled by every label (^XF), so a label only carries its
+# own lines: typically well under a hundred bytes.
+
+# Dots per inch of most desktop thermal printers; 300 is the other common one
+THERMAL_DPI = 203
+
+# Printer memory location of the stored ZPL formats
+ZPL_FORMAT_NAME = "R:LABEL{}.ZPL"
+
+# EPL bitmap fonts: font number -> (width, height) in dots, per printer DPI.
+# Font 5 only has upper-case letters and is left out.
+EPL_FONTS = {
+    203: {1: (8, 12), 2: (10, 16), 3: (12, 20), 4: (14, 24)},
+    300: {1: (12, 20), 2: (16, 28), 3: (20, 36), 4: (24, 44)},
+}
+
+# Gap between die-cut labels on the roll, for EPL's label length command
+EPL_GAP_MM = 3
+
+# EPL character set: 8-bit data in code page A (Windows-1252), US country code.
+# Label text is encoded to match; characters outside it print as "?".
+EPL_CODE_PAGE = "I8,A,001"
+EPL_ENCODING = "cp1252"
+
+
+# Scale factor from sheet pixels to printer dots
+def _scale(spec, dpi):
+    return dpi / spec["dpi"]
+
+# Label width and height in printer dots
+def _label_dots(spec, scale):
+    label_width, label_height = spec["label_size"]
+    return round(label_width * scale), round(label_height * scale)
+
+# Character height in printer dots for the spec's font size
+def _font_dots(spec, scale):
+    return max(1, round(spec["font"][1] * scale))
+
+# ^FD field data, hex-escaping the ZPL control characters and non-ASCII text
+def _zpl_field(text):
+    if text.isascii() and not any(char in text for char in "^~_"):
+        return f"^FD{text}^FS"
+    escaped = "".join(
+        char if char.isascii() and char not in "^~_" else "".join(f"_{byte:02X}" for byte in char.encode())
+        for char in text
+    )
+    return f"^FH^FD{escaped}^FS"
+
+# ZPL commands of a label's border, or of its text lines
+def _zpl_border(width, height, scale):
+    return f"^FO0,0^GB{width},{height},{max(1, round(scale))}^FS"
+
+def _zpl_lines(lines, scale, font_height):
+    return "".join(
+        f"^FO{round(dx * scale)},{round(dy * scale)}^A0N,{font_height}{_zpl_field(text)}"
+        for dx, dy, text in lines
+        if text
+    )
+
+# Yield the ZPL of each label in order, as bytes; stored formats are defined
+# just before the first label that recalls them
+def iter_zpl(specs, dpi=THERMAL_DPI):
+    formats = {}
+    for spec in specs:
+        scale = _scale(spec, dpi)
+        width, height = _label_dots(spec, scale)
+        font_height = _font_dots(spec, scale)
+        setup = f"^CI28^PW{width}^LL{height}^LH0,0"
+
+        for _, _, template, lines in spec["labels"]:
+            if template is None:
+                label = (
+                    f"^XA{setup}{_zpl_border(width, height, scale)}{_zpl_lines(lines, scale, font_height)}^XZ\n"
+                )
+            else:
+                template_lines = spec["templates"][template]
+                key = (tuple(template_lines), width, height, font_height)
+                name = formats.get(key)
+                if name is None:
+                    name = formats[key] = ZPL_FORMAT_NAME.format(len(formats))
+                    yield (
+                        f"^XA^DF{name}^FS{setup}{_zpl_border(width, height, scale)}"
+                        f"{_zpl_lines(template_lines, scale, font_height)}^XZ\n"
+                    ).encode("ascii")
+                label = f"^XA^XF{name}^FS{_zpl_lines(lines, scale, font_height)}^XZ\n"
+            yield label.encode("ascii")
+
+# EPL font number and multiplier whose characters come closest to `height`
+# dots without exceeding it
+def _epl_font(dpi, height):
+    fonts = EPL_FONTS[300 if dpi >= 250 else 203]
+    best = (1, 1, fonts[1][1])
+    for font, (_, font_height) in fonts.items():
+        multiplier = min(max(1, height // font_height), 9)
+        if best[2] < font_height * multiplier <= height:
+            best = (font, multiplier, font_height * multiplier)
+    return best[:2]
+
+# A quoted EPL string
+def _epl_string(text):
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+# Yield the EPL of each label in order, as bytes (Windows-1252 text); the code
+# page is selected with the first label size
+def iter_epl(specs, dpi=THERMAL_DPI):
+    size = None
+    for spec in specs:
+        scale = _scale(spec, dpi)
+        width, height = _label_dots(spec, scale)
+        font, multiplier = _epl_font(dpi, _font_dots(spec, scale))
+        border = f"X0,0,{max(1, round(scale))},{width - 1},{height - 1}\n"
+
+        if size != (width, height):
+            code_page = f"{EPL_CODE_PAGE}\n" if size is None else ""
+            size = (width, height)
+            yield f"\n{code_page}q{width}\nQ{height},{round(EPL_GAP_MM * dpi / 25.4)}\n".encode("ascii")
+
+        for _, _, template, lines in spec["labels"]:
+            if template is not None:
+                lines = spec["templates"][template] + lines
+            text = "".join(
+                f"A{round(dx * scale)},{round(dy * scale)},0,{font},{multiplier},{multiplier},N,"
+                f"{_epl_string(text)}\n"
+                for dx, dy, text in lines
+                if text
+            )
+            yield f"\nN\n{border}{text}P1\n".encode(EPL_ENCODING, errors="replace")
+
+# Printer language -> label stream generator
+THERMAL_LANGUAGES = {"zpl": iter_zpl, "epl": iter_epl}
+
+
+# Stream sheet descriptions as printer commands, one label per chunk
+def iter_thermal(specs, language="zpl", dpi=THERMAL_DPI):
+    return THERMAL_LANGUAGES[language](specs, dpi=dpi)
+
+# All labels of the sheet descriptions as one printer command file
+def render_thermal(specs, language="zpl", dpi=THERMAL_DPI):
+    return b"".join(iter_thermal(specs, language=language, dpi=dpi))
@@ -1,160 +1,130 @@
 import streamlit as st
-from PIL import Image, ImageDraw, ImageFont
-import io
-import zipfile
 import os
-
-from PIL import ImageFont
-import os
-
-def get_font(size):
-    font_path = os.path.join(os.path.dirname(__file__), "DejaVuSans-Bold.ttf")
-    try:
-        return ImageFont.truetype(font_path, size)
-    except OSError:
-        print("⚠️ Font file not found. Using default PIL font.")
-        return ImageFont.load_default()
-
-
-def calculate_optimal_font_size(label_width, label_height, sample_text_lines):
-    min_size = 8
-    max_size = 30
-    padding = 0.25
-    available_height = label_height - 0.5 * padding
-
-    best_size = min_size
-    for size in range(min_size, max_size + 1):
-        font = get_font(size)
-        line_heights = []
-        max_line_width = 0
-        for line in sample_text_lines:
-            bbox = font.getbbox(line)
-            line_height = bbox[3] - bbox[1]
-            line_width = bbox[2] - bbox[0]
-            line_heights.append(line_height)
-            max_line_width = max(max_line_width, line_width)
-
-        total_text_height = sum(line_heights)
-        if total_text_height <= available_height and max_line_width <= (label_width - 2 * padding):
-            best_size = size
-        else:
-            break
-
-    return best_size
-
-def generate_labels(date, invoice_no, supplier, items_data):
-    DPI = 300
-    A4_WIDTH_MM, A4_HEIGHT_MM = 210, 297
-    A4_WIDTH_PX = int(A4_WIDTH_MM / 25.4 * DPI)
-    A4_HEIGHT_PX = int(A4_HEIGHT_MM / 25.4 * DPI)
-    LABEL_WIDTH_MM, LABEL_HEIGHT_MM = 38, 21
-    LABEL_WIDTH_PX = int(LABEL_WIDTH_MM / 25.4 * DPI)
-    LABEL_HEIGHT_PX = int(LABEL_HEIGHT_MM / 25.4 * DPI)
-
-    COLS, ROWS = 5, 13
-    MAX_LABELS_PER_SHEET = COLS * ROWS
-
-    MARGIN_LEFT_RIGHT_MM = 6
-    MARGIN_TOP_BOTTOM_MM = 12
-    V_SPACING_MM = 2
-
-    MARGIN_LEFT_RIGHT_PX = int(MARGIN_LEFT_RIGHT_MM / 25.4 * DPI)
-    MARGIN_TOP_BOTTOM_PX = int(MARGIN_TOP_BOTTOM_MM / 25.4 * DPI)
-    v_spacing = int(V_SPACING_MM / 25.4 * DPI)
-
-    available_width = A4_WIDTH_PX - (2 * MARGIN_LEFT_RIGHT_PX)
-    available_height = A4_HEIGHT_PX - (2 * MARGIN_TOP_BOTTOM_PX)
-
-    total_label_width = COLS * LABEL_WIDTH_PX
-    total_label_height = ROWS * LABEL_HEIGHT_PX
-
-    h_spacing = (available_width - total_label_width) // (COLS - 1)
-
-    start_x = MARGIN_LEFT_RIGHT_PX
-    start_y = MARGIN_TOP_BOTTOM_PX
-
-    sample_lines = [
-        f"DATE: {date}",
-        f"INVOICE: {invoice_no}",
-        f"SUPPLIER: {supplier[:12]}",
-        "ITEM: 99",
-        "PIECE: 999/999"
-    ]
-
-    font_size = calculate_optimal_font_size(LABEL_WIDTH_PX, LABEL_HEIGHT_PX, sample_lines)
-    font = get_font(font_size)
-
-    sheet_number = 1
-    label_count = 0
-    sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
-    draw = ImageDraw.Draw(sheet)
-
-    saved_sheets = []
-    total_labels = sum(items_data.values())
-
-    for item_num, num_pieces in items_data.items():
-        for piece_num in range(1, num_pieces + 1):
-            if label_count >= MAX_LABELS_PER_SHEET:
-                buffer = io.BytesIO()
-                sheet.save(buffer, format="PNG", dpi=(DPI, DPI))
-                buffer.seek(0)
-                saved_sheets.append((f"Invoice_Labels_Sheet_{sheet_number}.png", buffer.read()))
-
-                sheet_number += 1
-                sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
-                draw = ImageDraw.Draw(sheet)
-                label_count = 0
-
-            col = label_count % COLS
-            row = label_count // COLS
-
-            x = start_x + col * (LABEL_WIDTH_PX + h_spacing)
-            y = start_y + row * (LABEL_HEIGHT_PX + v_spacing)
-
-            draw.rectangle(
-                [x, y, x + LABEL_WIDTH_PX - 1, y + LABEL_HEIGHT_PX - 1],
-                outline="black",
-                width=1
-            )
-
-            supplier_short = supplier[:12]
-            text_lines = [
-                f"DATE: {date}",
-                f"INVOICE: {invoice_no}",
-                f"SUPPLIER: {supplier_short}",
-                f"ITEM: {item_num}",
-                f"PIECE: {piece_num}/{num_pieces}"
-            ]
-
-            padding = 6
-            line_heights = []
-            for line in text_lines:
-                bbox = font.getbbox(line)
-                line_heights.append(bbox[3] - bbox[1])
-
-            total_text_height = sum(line_heights)
-            available_label_height = LABEL_HEIGHT_PX - 2 * padding
-            remaining_space = available_label_height - total_text_height
-
-            if len(text_lines) > 1:
-                line_spacing = int(remaining_space // (len(text_lines) - 1))
-            else:
-                line_spacing = 0
-
-            current_y = y + padding
-            for i, line in enumerate(text_lines):
-                draw.text((x + padding, current_y), line, fill="black", font=font)
-                current_y += line_heights[i] + line_spacing
-
-            label_count += 1
-
-    # Save last sheet
-    buffer = io.BytesIO()
-    sheet.save(buffer, format="PNG", dpi=(DPI, DPI))
-    buffer.seek(0)
-    saved_sheets.append((f"Invoice_Labels_Sheet_{sheet_number}.png", buffer.read()))
-
-    return saved_sheets, font_size, total_labels, sheet_number
+from functools import partial
+
+from label_engine import INVOICE_LAYOUT, iter_sheets, layout_job, zip_sheets
+from label_cache import iter_cached_sheets
+from label_jobs import RENDER_WORKERS, render_pool, submit_job
+from label_pdf import render_pdf
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), "DejaVuSans-Bold.ttf")
+
+# 38 x 21 mm labels with the columns spread across the page, every field on its
+# own line and the supplier name cut to 12 characters
+LABEL_LAYOUT = dict(
+    INVOICE_LAYOUT,
+    label_mm=(38, 21),
+    spacing_mm=(None, 2),
+    font_sizes=(8, 30),
+    supplier_chars=12,
+    fixed_lines=["DATE: {date}", "INVOICE: {invoice_no}", "SUPPLIER: {supplier}"],
+    item_lines=["ITEM: {item}", "PIECE: {piece}/{pieces}"],
+    separator_lines=["INVOICE: {invoice_no}", "SUPPLIER: {supplier}", "LABELS: {labels}"],
+)
+
+# Lay the job out as sheet descriptions; returns (sheet specs, font size)
+def layout_labels(date, invoice_no, supplier, items_data, canvas_mode="RGB", stats=None):
+    return layout_job(
+        LABEL_LAYOUT, FONT_PATH, date, invoice_no, supplier, items_data, canvas_mode=canvas_mode, stats=stats
+    )
+
+# Lay the job out and return (iterator of (filename, png bytes), font size,
+# total labels, sheet count); sheets are rendered as the iterator is consumed.
+# With use_cache, sheets unchanged since an earlier job are reused.
+def stream_labels(date, invoice_no, supplier, items_data, parallel=False, canvas_mode="RGB", use_cache=False,
+                  stats=None, pipeline=False):
+    sheet_specs, font_size = layout_labels(
+        date, invoice_no, supplier, items_data, canvas_mode=canvas_mode, stats=stats
+    )
+    named_sheets = render_named_sheets(
+        sheet_specs, parallel=parallel, use_cache=use_cache, stats=stats, pipeline=pipeline
+    )
+    return named_sheets, font_size, sum(items_data.values()), len(sheet_specs)
+
+# Render laid-out sheets lazily as (filename, png bytes), in sheet order; with
+# `pool`, on that long-lived process pool of max_workers workers
+def render_named_sheets(sheet_specs, parallel=False, use_cache=False, stats=None, pipeline=False, pool=None,
+                        max_workers=None):
+    if use_cache:
+        sheets = iter_cached_sheets(
+            sheet_specs, parallel=parallel, stats=stats, pipeline=pipeline, pool=pool, max_workers=max_workers
+        )
+    else:
+        sheets = iter_sheets(
+            sheet_specs, parallel=parallel, max_workers=max_workers, stats=stats, pipeline=pipeline, pool=pool
+        )
+    return (
+        (f"Invoice_Labels_Sheet_{sheet_number}.png", sheet_data)
+        for sheet_number, sheet_data in enumerate(sheets, start=1)
+    )
+
+def generate_labels(date, invoice_no, supplier, items_data, parallel=False, canvas_mode="RGB", use_cache=False,
+                    stats=None, pipeline=False):
+    named_sheets, font_size, total_labels, sheet_count = stream_labels(
+        date, invoice_no, supplier, items_data, parallel=parallel, canvas_mode=canvas_mode, use_cache=use_cache,
+        stats=stats, pipeline=pipeline
+    )
+    return list(named_sheets), font_size, total_labels, sheet_count
+
+# All sheets of the job as one ZIP; returns (zip bytes, font size, total labels,
+# sheet count).  Each sheet goes into the archive as soon as it is encoded, so
+# only the archive itself is ever held, and it spills to disk once it is large.
+def generate_labels_zip(date, invoice_no, supplier, items_data, parallel=False, canvas_mode="RGB",
+                        use_cache=False, pipeline=False):
+    named_sheets, font_size, total_labels, sheet_count = stream_labels(
+        date, invoice_no, supplier, items_data, parallel=parallel, canvas_mode=canvas_mode, use_cache=use_cache,
+        pipeline=pipeline
+    )
+    with zip_sheets(named_sheets) as archive:
+        return archive.read(), font_size, total_labels, sheet_count
+
+# All sheets of the job as one vector PDF; returns (pdf bytes, font size, sheet count)
+def generate_labels_pdf(date, invoice_no, supplier, items_data):
+    sheet_specs, font_size = layout_labels(date, invoice_no, supplier, items_data)
+    return render_pdf(sheet_specs, title=f"Invoice {invoice_no} labels"), font_size, len(sheet_specs)
+
+# PDF bytes of the whole job, for deferred download buttons
+def generate_labels_pdf_data(date, invoice_no, supplier, items_data):
+    return generate_labels_pdf(date, invoice_no, supplier, items_data)[0]
+
+# Start rendering the job's sheets in the background; returns (LabelJob, font
+# size, total labels).  Submitting a job that is already registered returns it.
+def start_labels_job(date, invoice_no, supplier, items_data, retry=False):
+    sheet_specs, font_size = layout_labels(date, invoice_no, supplier, items_data, canvas_mode="L")
+    stream = partial(render_named_sheets, use_cache=True, pool=render_pool(), max_workers=RENDER_WORKERS)
+    job = submit_job(sheet_specs, stream, retry=retry)
+    return job, font_size, sum(items_data.values())
+
+# ZIP bytes of a finished job's sheets, for deferred download buttons
+def labels_job_zip(job):
+    with zip_sheets(job.completed_sheets()) as archive:
+        return archive.read()
+
+# Progress of a background job, refreshed every second while it runs; the
+# latest finished sheet is shown as soon as it is encoded
+def show_labels_job(job, font_size, total_labels):
+    if not job.done:
+        names = job.completed_names()
+        st.progress(job.progress(), text=f"Rendered {len(names)} of {job.sheet_count} sheet(s)...")
+        if names:
+            st.image(job.sheet_data(len(names) - 1), caption=names[-1], width=300)
+        return
+    if st.session_state.get("label_job_polling"):
+        # Re-run the whole script, so the finished job is no longer polled
+        st.session_state["label_job_polling"] = False
+        st.rerun()
+
+    if job.error is not None:
+        st.error(f"Label generation failed: {job.error}")
+        return
+
+    st.success(f"✅ Generated {total_labels} labels across {job.sheet_count} sheet(s) | Font Size: {font_size}pt")
+    st.download_button(
+        label="📥 Download All Label Sheets (ZIP)",
+        data=partial(labels_job_zip, job),
+        file_name="Invoice_Labels.zip",
+        mime="application/zip"
+    )
 
 # Streamlit App  
 st.title("🖨️ Invoice Label Generator")
@@ -170,20 +140,20 @@ for i in range(1, num_items + 1):
     pieces = st.number_input(f"Number of pieces for Item {i}", min_value=1, max_value=1000, value=1, key=f"item_{i}")
     items_data[i] = pieces
 
-if st.button("Generate Labels"):
-    with st.spinner("Generating labels..."):
-        saved_sheets, font_size, total_labels, sheet_count = generate_labels(date, invoice_no, supplier, items_data)
-
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-            for filename, data in saved_sheets:
-                zip_file.writestr(filename, data)
-
-        st.success(f"✅ Generated {total_labels} labels across {sheet_count} sheet(s) | Font Size: {font_size}pt")
-
-        st.download_button(
-            label="📥 Download All Label Sheets (ZIP)",
-            data=zip_buffer.getvalue(),
-            file_name="Invoice_Labels.zip",
-            mime="application/zip"
-        )
+generate = st.button("Generate Labels")
+if generate:
+    # Kept across reruns; the sheets render on a background thread
+    st.session_state["label_job"] = (date, invoice_no, supplier, dict(items_data))
+
+if "label_job" in st.session_state:
+    # Joins the job if it is still running instead of starting over
+    job, font_size, total_labels = start_labels_job(*st.session_state["label_job"], retry=generate)
+    st.session_state["label_job_polling"] = not job.done
+    st.fragment(show_labels_job, run_every=None if job.done else 1)(job, font_size, total_labels)
+
+    st.download_button(
+        label="📥 Download All Label Sheets (PDF)",
+        data=partial(generate_labels_pdf_data, *st.session_state["label_job"]),
+        file_name="Invoice_Labels.pdf",
+        mime="application/pdf"
+    )
@@ -1,7 +1,93 @@
 import streamlit as st
 from PIL import Image, ImageDraw, ImageFont
 import io
-import base64
+from functools import partial
+
+from label_engine import label_pieces, zip_sheets
+
+# Sticker Settings
+STICKER_WIDTH, STICKER_HEIGHT = 400, 200  # Size of each sticker
+FONT_SIZE = 25
+
+# Rows of stickers per page image, so a page has the same bounded size however
+# many pieces the job has
+ROWS_PER_PAGE = 20
+
+# Load font (default if Arial not found)
+def load_sticker_font():
+    try:
+        return ImageFont.truetype("arial.ttf", FONT_SIZE)
+    except OSError:
+        return ImageFont.load_default()
+
+# Draw a run of stickers onto one page image, num_columns per row
+def draw_page(stickers, num_columns, date, invoice_no, supplier, font):
+    num_rows = (len(stickers) + num_columns - 1) // num_columns
+    page = Image.new("RGB", (STICKER_WIDTH * num_columns, STICKER_HEIGHT * num_rows), "white")
+    draw = ImageDraw.Draw(page)
+
+    for current_piece_index, (item_num, piece_num, num_pieces) in enumerate(stickers):
+        row = current_piece_index // num_columns
+        col = current_piece_index % num_columns
+        x_position = col * STICKER_WIDTH
+        y_position = row * STICKER_HEIGHT
+
+        # Draw sticker border
+        draw.rectangle(
+            [x_position, y_position, x_position + STICKER_WIDTH, y_position + STICKER_HEIGHT],
+            outline="black",
+            width=2
+        )
+
+        # Text to write on sticker
+        text_lines = [
+            f"Date: {date}",
+            f"Invoice: {invoice_no}",
+            f"Supplier: {supplier}",
+            f"Item: {item_num}",
+            f"Piece: {piece_num}/{num_pieces}"
+        ]
+
+        total_text_height = len(text_lines) * (FONT_SIZE + 10)
+        start_y_text = y_position + (STICKER_HEIGHT - total_text_height) // 2
+
+        for i, line in enumerate(text_lines):
+            text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
+            x_text = x_position + (STICKER_WIDTH - text_width) // 2
+            y_text = start_y_text + (i * (FONT_SIZE + 10))
+            draw.text((x_text, y_text), line, font=font, fill="black")
+
+    return page
+
+# Number of pages the job needs
+def page_count(item_pieces, num_columns):
+    per_page = ROWS_PER_PAGE * num_columns
+    return (sum(item_pieces.values()) + per_page - 1) // per_page
+
+# One page of the job as PNG bytes (page numbers start at 1)
+def render_page(date, invoice_no, supplier, item_pieces, num_columns, page_number, font=None):
+    per_page = ROWS_PER_PAGE * num_columns
+    first = (page_number - 1) * per_page
+    stickers = label_pieces(item_pieces, first, per_page)
+    page = draw_page(stickers, num_columns, date, invoice_no, supplier, font or load_sticker_font())
+    img_buffer = io.BytesIO()
+    page.save(img_buffer, format="PNG")
+    return img_buffer.getvalue()
+
+# Yield (filename, png bytes) page by page; each page is drawn and encoded only
+# when the previous one has been consumed, so one page is held at a time
+def iter_pages(date, invoice_no, supplier, item_pieces, num_columns):
+    font = load_sticker_font()
+    for page_number in range(1, page_count(item_pieces, num_columns) + 1):
+        yield f"stickers_page_{page_number}.png", render_page(
+            date, invoice_no, supplier, item_pieces, num_columns, page_number, font=font
+        )
+
+# Every page as one ZIP, built only when its download button is clicked
+def stickers_zip(date, invoice_no, supplier, item_pieces, num_columns):
+    with zip_sheets(iter_pages(date, invoice_no, supplier, item_pieces, num_columns)) as archive:
+        return archive.read()
+
 
 # App Title
 st.title("Sticker Sheet Generator")
@@ -25,72 +111,41 @@ for item_num in range(1, num_different_items + 1):
 
 num_columns = st.sidebar.number_input("Number of Stickers per Row:", min_value=1, value=4)
 
-# Sticker Settings
-STICKER_WIDTH, STICKER_HEIGHT = 400, 200  # Size of each sticker
-FONT_SIZE = 25
-
-# Calculate number of rows and total image dimensions
-num_rows = (total_pieces + num_columns - 1) // num_columns
-total_width = STICKER_WIDTH * num_columns
-total_height = STICKER_HEIGHT * num_rows
-
 # Button to Generate Stickers
 if st.sidebar.button("Generate Stickers"):
-    # Create a blank image
-    sticker_sheet = Image.new("RGB", (total_width, total_height), "white")
-    draw = ImageDraw.Draw(sticker_sheet)
-
-    # Load font (default if Arial not found)
-    try:
-        font = ImageFont.truetype("arial.ttf", FONT_SIZE)
-    except:
-        font = ImageFont.load_default()
-
-    # Generate Stickers
-    current_piece_index = 0
-    for item_num, num_pieces in item_pieces.items():
-        for piece_num in range(1, num_pieces + 1):
-            row = current_piece_index // num_columns
-            col = current_piece_index % num_columns
-            x_position = col * STICKER_WIDTH
-            y_position = row * STICKER_HEIGHT
-
-            # Draw sticker border
-            draw.rectangle(
-                [x_position, y_position, x_position + STICKER_WIDTH, y_position + STICKER_HEIGHT],
-                outline="black",
-                width=2
-            )
-
-            # Text to write on sticker
-            text_lines = [
-                f"Date: {date}",
-                f"Invoice: {invoice_no}",
-                f"Supplier: {supplier}",
-                f"Item: {item_num}",
-                f"Piece: {piece_num}/{num_pieces}"
-            ]
-
-            total_text_height = len(text_lines) * (FONT_SIZE + 10)
-            start_y_text = y_position + (STICKER_HEIGHT - total_text_height) // 2
-
-            for i, line in enumerate(text_lines):
-                text_width, text_height = draw.textbbox((0, 0), line, font=font)[2:]
-                x_text = x_position + (STICKER_WIDTH - text_width) // 2
-                y_text = start_y_text + (i * (FONT_SIZE + 10))
-                draw.text((x_text, y_text), line, font=font, fill="black")
-
-            current_piece_index += 1
-
-    # Convert image to bytes for display and download
-    img_buffer = io.BytesIO()
-    sticker_sheet.save(img_buffer, format="PNG")
-    img_buffer.seek(0)
+    # Keep the job across reruns, so paging and downloads do not lose it
+    st.session_state["sticker_job"] = (date, invoice_no, supplier, dict(item_pieces), num_columns)
+    st.session_state["sticker_page"] = 1
+
+if "sticker_job" in st.session_state:
+    job = st.session_state["sticker_job"]
+    job_pieces = sum(job[3].values())
+    total_pages = page_count(job[3], job[4])
+
+    # All pages, streamed into a ZIP when the button is clicked
+    st.download_button(
+        label=f"📥 Download All {total_pages} Sticker Page(s) (ZIP)",
+        data=partial(stickers_zip, *job),
+        file_name="stickers.zip",
+        mime="application/zip"
+    )
+
+    # Only the page on screen is rendered
+    page_number = 1
+    if total_pages > 1:
+        page_number = st.number_input(
+            f"Page (1-{total_pages})", min_value=1, max_value=total_pages, key="sticker_page"
+        )
+    page_data = render_page(*job, page_number)
 
     # Show image in app
-    st.image(img_buffer, caption=f"{total_pieces} Stickers Generated", use_column_width=True)
+    st.image(page_data, caption=f"{job_pieces} Stickers Generated (page {page_number} of {total_pages})",
+             use_column_width=True)
 
     # Download button
-    b64 = base64.b64encode(img_buffer.getvalue()).decode()
-    href = f'<a href="data:file/png;base64,{b64}" download="stickers.png">📥 Download Sticker Sheet</a>'
-    st.markdown(href, unsafe_allow_html=True)
+    st.download_button(
+        label=f"📥 Download Sticker Page {page_number}",
+        data=page_data,
+        file_name=f"stickers_page_{page_number}.png",
+        mime="image/png"
+    )
@@ -1,6 +1,12 @@
 import streamlit as st
-from PIL import Image, ImageDraw, ImageFont
-import io
+from functools import partial
+
+from label_engine import (
+    INVOICE_LAYOUT, PREVIEW_SHEETS_PER_PAGE, generate_job, generate_job_pdf, iter_sheets, job_pdf_data, layout_job,
+    layout_jobs, stream_job,
+)
+from label_cache import cached_sheet, iter_cached_previews, iter_cached_sheets
+from label_thermal import THERMAL_DPI, THERMAL_LANGUAGES, iter_thermal
 
 # --------- Wilton Weaver Theme CSS ---------
 def set_wilton_theme():
@@ -98,112 +104,49 @@ def set_wilton_theme():
     </style>
     """, unsafe_allow_html=True)
 
-# --------- Font Loader ---------
-def get_font(size):
-    return ImageFont.truetype("DejaVuSans-Bold.ttf", size)
-
-# --------- Optimal Font Size ---------
-def calculate_optimal_font_size(label_width, label_height, sample_text_lines):
-    min_size, max_size = 8, 28
-    padding = 0.25
-    available_height = label_height - 0.5 * padding
-    best_size = min_size
-    for size in range(min_size, max_size + 1):
-        font = get_font(size)
-        line_heights, max_line_width = [], 0
-        for line in sample_text_lines:
-            bbox = font.getbbox(line)
-            line_height = bbox[3] - bbox[1]
-            line_width = bbox[2] - bbox[0]
-            line_heights.append(line_height)
-            max_line_width = max(max_line_width, line_width)
-        total_text_height = sum(line_heights)
-        if total_text_height <= available_height and max_line_width <= (label_width - 2 * padding):
-            best_size = size
-        else:
-            break
-    return best_size
-
-# --------- Label Generation ---------
-def generate_invoice_labels(date, invoice_no, supplier, items_data):
-    DPI = 300
-    A4_WIDTH_MM, A4_HEIGHT_MM = 210, 297
-    LABEL_WIDTH_MM, LABEL_HEIGHT_MM = 37.02, 20.99
-    COLS, ROWS = 5, 13
-    MARGIN_LEFT_RIGHT_MM = 6
-    MARGIN_TOP_BOTTOM_MM = 12
-    H_SPACING_MM, V_SPACING_MM = 2, 0
-
-    A4_WIDTH_PX = int(A4_WIDTH_MM / 25.4 * DPI)
-    A4_HEIGHT_PX = int(A4_HEIGHT_MM / 25.4 * DPI)
-    LABEL_WIDTH_PX = int(LABEL_WIDTH_MM / 25.4 * DPI)
-    LABEL_HEIGHT_PX = int(LABEL_HEIGHT_MM / 25.4 * DPI)
-    MARGIN_LEFT_RIGHT_PX = int(MARGIN_LEFT_RIGHT_MM / 25.4 * DPI)
-    MARGIN_TOP_BOTTOM_PX = int(MARGIN_TOP_BOTTOM_MM / 25.4 * DPI)
-    h_spacing = int(H_SPACING_MM / 25.4 * DPI)
-    v_spacing = int(V_SPACING_MM / 25.4 * DPI)
-
-    MAX_LABELS = COLS * ROWS
-    start_x, start_y = MARGIN_LEFT_RIGHT_PX, MARGIN_TOP_BOTTOM_PX
-
-    sample_lines = [
-        f"DATE: {date}",
-        f"INVOICE: {invoice_no}",
-        f"SUPPLIER: {supplier}",
-        "ITEM: 99",
-        "PIECE: 999/999"
-    ]
-    font_size = calculate_optimal_font_size(LABEL_WIDTH_PX, LABEL_HEIGHT_PX, sample_lines)
-    font = get_font(font_size)
-
-    sheets, label_count, sheet_number = [], 0, 1
-    sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
-    draw = ImageDraw.Draw(sheet)
-
-    for item, pieces in items_data.items():
-        for p in range(1, pieces + 1):
-            if label_count >= MAX_LABELS:
-                buf = io.BytesIO()
-                sheet.save(buf, format="PNG", dpi=(DPI, DPI))
-                sheets.append(buf.getvalue())
-                sheet = Image.new("RGB", (A4_WIDTH_PX, A4_HEIGHT_PX), "white")
-                draw = ImageDraw.Draw(sheet)
-                label_count = 0
-                sheet_number += 1
-
-            col = label_count % COLS
-            row = label_count // COLS
-            x = start_x + col * (LABEL_WIDTH_PX + h_spacing)
-            y = start_y + row * (LABEL_HEIGHT_PX + v_spacing)
-
-            draw.rectangle([x, y, x + LABEL_WIDTH_PX - 1, y + LABEL_HEIGHT_PX - 1], outline="black", width=1)
-
-            lines = [
-                f" DATE: {date}",
-                f" INVOICE: {invoice_no}",
-                f" SUPPLIER: {supplier}",
-                "",
-                f" ITEM: {item} ; PIECE: {p}/{pieces}"
-            ]
-
-            padding = 6
-            line_heights = [font.getbbox(line)[3] - font.getbbox(line)[1] for line in lines]
-            total_text_height = sum(line_heights)
-            remaining_space = LABEL_HEIGHT_PX - 2 * padding - total_text_height
-            line_spacing = int(remaining_space // (len(lines) - 1)) if len(lines) > 1 else 0
-
-            current_y = y + padding
-            for i, line in enumerate(lines):
-                draw.text((x + padding, current_y), line, fill="black", font=font)
-                current_y += line_heights[i] + line_spacing
-
-            label_count += 1
-
-    buf = io.BytesIO()
-    sheet.save(buf, format="PNG", dpi=(DPI, DPI))
-    sheets.append(buf.getvalue())
-
-    return sheets, font_size, sheet_number
+# --------- Label Layout ---------
+FONT_PATH = "DejaVuSans-Bold.ttf"
+
+LABEL_LAYOUT = INVOICE_LAYOUT
+
+# The job helpers of label_engine, bound to this layout and font
+layout_invoice_labels = partial(layout_job, LABEL_LAYOUT, FONT_PATH)
+stream_invoice_labels = partial(stream_job, LABEL_LAYOUT, FONT_PATH)
+generate_invoice_labels = partial(generate_job, LABEL_LAYOUT, FONT_PATH)
+generate_invoice_labels_pdf = partial(generate_job_pdf, LABEL_LAYOUT, FONT_PATH)
+generate_labels_pdf_data = partial(job_pdf_data, LABEL_LAYOUT, FONT_PATH)
+
+# Lay several invoices, as (date, invoice no, supplier, items_data) jobs, out
+# back to back on shared sheets; returns (sheet specs, font size).  See
+# label_engine.layout_jobs for separators and start_cell.
+def layout_packed_invoice_labels(jobs, separators=False, start_cell=0, canvas_mode="RGB", stats=None):
+    return layout_jobs(
+        LABEL_LAYOUT, FONT_PATH, jobs, separators=separators, start_cell=start_cell, canvas_mode=canvas_mode,
+        stats=stats
+    )
+
+# generate_invoice_labels for several invoices packed onto shared sheets
+def generate_packed_invoice_labels(jobs, separators=False, start_cell=0, parallel=False, canvas_mode="RGB",
+                                   use_cache=False, stats=None):
+    sheet_specs, font_size = layout_packed_invoice_labels(
+        jobs, separators=separators, start_cell=start_cell, canvas_mode=canvas_mode, stats=stats
+    )
+    if use_cache:
+        sheets = iter_cached_sheets(sheet_specs, parallel=parallel, stats=stats)
+    else:
+        sheets = iter_sheets(sheet_specs, parallel=parallel, stats=stats)
+    return list(sheets), font_size, len(sheet_specs)
+
+# Lay the job out for a thermal printer and return (iterator of per-label ZPL /
+# EPL bytes, font size, label count); labels are generated as it is consumed
+def stream_invoice_labels_thermal(date, invoice_no, supplier, items_data, language="zpl", dpi=THERMAL_DPI):
+    sheet_specs, font_size = layout_invoice_labels(date, invoice_no, supplier, items_data)
+    return iter_thermal(sheet_specs, language=language, dpi=dpi), font_size, sum(items_data.values())
+
+# Printer command file of the whole job, for deferred download buttons
+def generate_labels_thermal_data(date, invoice_no, supplier, items_data, language="zpl", dpi=THERMAL_DPI):
+    labels = stream_invoice_labels_thermal(date, invoice_no, supplier, items_data, language=language, dpi=dpi)[0]
+    return b"".join(labels)
 
 # --------- Main App ---------
 def main():
@@ -238,19 +181,63 @@ def main():
         if not date or not invoice_no or not supplier:
             st.error("Please fill all fields!")
         else:
-            with st.spinner("Generating labels..."):
-                sheets, font_size, total_sheets = generate_invoice_labels(date, invoice_no, supplier, items_data)
-
-            st.success(f"✅ {sum(items_data.values())} labels generated across {total_sheets} sheet(s)!")
+            # Keep the job across reruns, so paging and downloads do not lose it
+            st.session_state["label_job"] = (date, invoice_no, supplier, dict(items_data))
+            st.session_state["preview_page"] = 1
             st.balloons()
-            st.markdown("---")
 
-            for idx, sheet_data in enumerate(sheets):
+    if "label_job" in st.session_state:
+        date, invoice_no, supplier, items_data = st.session_state["label_job"]
+        sheet_specs, font_size = layout_invoice_labels(date, invoice_no, supplier, items_data, canvas_mode="L")
+        total_sheets = len(sheet_specs)
+
+        st.success(f"✅ {sum(items_data.values())} labels generated across {total_sheets} sheet(s)!")
+
+        # One vector PDF with every sheet, built only when the button is clicked
+        st.download_button(
+            label="⬇️ Download All Sheets (PDF)",
+            data=partial(generate_labels_pdf_data, date, invoice_no, supplier, items_data),
+            file_name="Wilton_Weaver_Labels.pdf",
+            mime="application/pdf",
+            key="download_pdf"
+        )
+
+        # Piece labels for a thermal label printer, as ZPL / EPL commands
+        col1, col2 = st.columns(2)
+        with col1:
+            language = st.selectbox(
+                "🖨️ Thermal printer language", list(THERMAL_LANGUAGES), format_func=str.upper
+            )
+        with col2:
+            dpi = st.selectbox("Printer resolution (DPI)", [203, 300])
+        st.download_button(
+            label=f"⬇️ Download Labels for Thermal Printer ({language.upper()})",
+            data=partial(generate_labels_thermal_data, date, invoice_no, supplier, items_data, language, dpi),
+            file_name=f"Wilton_Weaver_Labels.{language}",
+            mime="text/plain",
+            key="download_thermal"
+        )
+        st.markdown("---")
+
+        # Screen-resolution previews, a few sheets per page; a 300 DPI sheet is
+        # only rendered when its download button is clicked
+        total_pages = (total_sheets + PREVIEW_SHEETS_PER_PAGE - 1) // PREVIEW_SHEETS_PER_PAGE
+        page = 1
+        if total_pages > 1:
+            page = st.number_input(
+                f"Preview page (1-{total_pages})", min_value=1, max_value=total_pages, key="preview_page"
+            )
+        first = (page - 1) * PREVIEW_SHEETS_PER_PAGE
+        page_specs = sheet_specs[first:first + PREVIEW_SHEETS_PER_PAGE]
+
+        with st.spinner("Generating previews..."):
+            previews = iter_cached_previews(page_specs)
+            for idx, (spec, preview) in enumerate(zip(page_specs, previews), start=first):
                 st.markdown(f"### 📄 Sheet {idx + 1}")
-                st.image(sheet_data, use_column_width=True)
+                st.image(preview, use_column_width=True)
                 st.download_button(
                     label=f"⬇️ Download Sheet {idx + 1}",
-                    data=sheet_data,
+                    data=partial(cached_sheet, spec),
                     file_name=f"Wilton_Weaver_Sheet_{idx + 1}.png",
                     mime="image/png",
                     key=f"download_{idx}"
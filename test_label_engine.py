@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from label_engine import (
+    INVOICE_LAYOUT, atlas_supported, draw_sheet, label_pieces, layout_job, layout_jobs, load_font,
+)
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), "DejaVuSans-Bold.ttf")
+
+# 38 x 21 mm labels, so long lines run into the neighbouring cells
+SMALL_LAYOUT = dict(INVOICE_LAYOUT, label_mm=(38, 21), spacing_mm=(None, 2), font_sizes=(8, 30))
+
+SUPPLIERS = [
+    "ACME",
+    "AVA Textiles, Wilton (P) Ltd. #12",
+    # Characters outside the glyph atlas go through ImageDraw per line
+    "Müller & Söhne",
+    "Sri Venkateshwara Handloom Weavers Co-operative Society Limited",
+]
+
+
+def assert_same_pixels(spec, other):
+    assert np.array_equal(np.asarray(draw_sheet(spec)), np.asarray(draw_sheet(other)))
+
+
+@pytest.mark.parametrize("supplier", SUPPLIERS)
+@pytest.mark.parametrize("layout", [INVOICE_LAYOUT, SMALL_LAYOUT], ids=["invoice", "small"])
+@pytest.mark.parametrize("mode", ["L", "RGB"])
+def test_atlas_draws_the_same_pixels_as_draw_text(supplier, layout, mode):
+    specs, font_size = layout_job(layout, FONT_PATH, "01-07-2024", "INV-12345", supplier, {1: 40, 22: 3},
+                                  canvas_mode=mode)
+    assert atlas_supported(load_font(FONT_PATH, font_size))
+    for spec in specs:
+        assert_same_pixels(spec, dict(spec, text_renderer="draw"))
+
+
+@pytest.mark.parametrize("supplier", SUPPLIERS)
+@pytest.mark.parametrize("mode", ["1", "L", "RGB"])
+def test_templates_draw_the_same_pixels_as_plain_labels(supplier, mode):
+    jobs = [("01-07-2024", "INV-12345", supplier, {1: 40, 22: 3}), ("02-07-2024", "INV-9", "ACME", {7: 30})]
+    stamped, _ = layout_jobs(SMALL_LAYOUT, FONT_PATH, jobs, separators=True, canvas_mode=mode)
+    plain, _ = layout_jobs(SMALL_LAYOUT, FONT_PATH, jobs, separators=True, stamp_template=False, canvas_mode=mode)
+    for spec, plain_spec in zip(stamped, plain):
+        assert_same_pixels(spec, dict(plain_spec, text_renderer="draw"))
+
+
+def test_label_pieces_slices_the_job_without_listing_it():
+    items_data = {1: 3, "B": 1, 7: 4}
+    every_piece = [(1, 1, 3), (1, 2, 3), (1, 3, 3), ("B", 1, 1), (7, 1, 4), (7, 2, 4), (7, 3, 4), (7, 4, 4)]
+    assert label_pieces(items_data) == every_piece
+    for first in range(len(every_piece) + 2):
+        for count in range(1, 5):
+            assert label_pieces(items_data, first, count) == every_piece[first:first + count]
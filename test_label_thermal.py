@@ -0,0 +1,79 @@
+import os
+import re
+
+from label_engine import INVOICE_LAYOUT, layout_job
+from label_thermal import _epl_string, _zpl_field, iter_epl, iter_zpl, render_thermal
+
+FONT_PATH = os.path.join(os.path.dirname(__file__), "DejaVuSans-Bold.ttf")
+
+
+# A hand-made sheet description: two labels sharing one template
+def make_spec(label_size=(600, 300), supplier="ACME"):
+    return {
+        "size": (1200, 300),
+        "dpi": 300,
+        "mode": "L",
+        "font": (FONT_PATH, 30),
+        "label_size": label_size,
+        "templates": [[(10, 10, "DATE: 01-07-2024"), (10, 50, f"SUPPLIER: {supplier}")]],
+        "labels": [
+            (0, 0, 0, [(10, 100, "ITEM: 1 ; PIECE: 1/2")]),
+            (600, 0, 0, [(10, 100, "ITEM: 1 ; PIECE: 2/2")]),
+        ],
+    }
+
+
+def test_zpl_stores_each_template_once_and_recalls_it():
+    zpl = render_thermal([make_spec(), make_spec()], language="zpl").decode("ascii")
+    assert zpl.count("^DF") == 1
+    assert zpl.count("^XF") == 4
+    assert zpl.index("^DF") < zpl.index("^XF")
+    # The stored format holds the fixed lines; labels only carry their own
+    assert zpl.count("SUPPLIER: ACME") == 1
+    assert zpl.count("PIECE: 1/2") == 2
+
+
+def test_zpl_stores_a_format_per_distinct_template():
+    zpl = render_thermal([make_spec(), make_spec(supplier="Wilton")], language="zpl").decode("ascii")
+    assert zpl.count("^DF") == 2
+    assert "^XFR:LABEL0.ZPL^FS" in zpl and "^XFR:LABEL1.ZPL^FS" in zpl
+
+
+def test_zpl_field_escapes_control_characters_and_non_ascii():
+    assert _zpl_field("ACME 12/40") == "^FDACME 12/40^FS"
+    assert _zpl_field("A^B~C_D") == "^FH^FDA_5EB_7EC_5FD^FS"
+    assert _zpl_field("Müller") == "^FH^FDM_C3_BCller^FS"
+
+
+def test_zpl_is_ascii_for_non_ascii_text():
+    spec = make_spec(supplier="Müller & Söhne")
+    zpl = render_thermal([spec], language="zpl")
+    zpl.decode("ascii")
+    assert b"M_C3_BCller & S_C3_B6hne" in zpl
+
+
+def test_zpl_numbers_pieces_per_item():
+    specs, _ = layout_job(INVOICE_LAYOUT, FONT_PATH, "01-07-2024", "INV-1", "ACME", {1: 2, 2: 3})
+    labels = [label.decode("ascii") for label in iter_zpl(specs) if b"^DF" not in label]
+    pieces = [re.search(r"ITEM: (\w+) ; PIECE: (\d+/\d+)", label).groups() for label in labels]
+    assert pieces == [("1", "1/2"), ("1", "2/2"), ("2", "1/3"), ("2", "2/3"), ("2", "3/3")]
+
+
+def test_epl_selects_the_code_page_once_before_the_first_label():
+    small = make_spec(label_size=(300, 150))
+    epl = render_thermal([make_spec(), small], language="epl")
+    assert epl.startswith(b"\nI8,A,001\nq")
+    assert epl.count(b"I8,A,001") == 1
+    # A second label size only repeats the size commands
+    assert epl.count(b"\nq") == 2
+    assert epl.count(b"\nP1\n") == 4
+
+
+def test_epl_string_quotes_backslashes_and_quotes():
+    assert _epl_string("ACME") == '"ACME"'
+    assert _epl_string('say "hi" \\') == '"say \\"hi\\" \\\\"'
+
+
+def test_epl_encodes_cp1252_and_replaces_other_characters():
+    epl = b"".join(iter_epl([make_spec(supplier="Müller € 漢")]))
+    assert b'"SUPPLIER: M\xfcller \x80 ?"' in epl